@@ -1,5 +1,6 @@
 from django.core.management.base import BaseCommand
 from lead_extractor.models import NormalizedNiche, NormalizedLocation
+from lead_extractor.services.normalization import normalize_location
 
 
 class Command(BaseCommand):
@@ -149,6 +150,9 @@ class Command(BaseCommand):
             if created:
                 self.stdout.write(f'  ✓ Criado: {location.display_name}')
         
+        # Invalida a memoização local (processos web precisam de restart)
+        normalize_location.cache_clear()
+
         self.stdout.write(self.style.SUCCESS(f'\n✓ População concluída!'))
         self.stdout.write(f'  - Nichos: {NormalizedNiche.objects.filter(is_active=True).count()}')
         self.stdout.write(f'  - Cidades: {NormalizedLocation.objects.filter(is_active=True).count()}')
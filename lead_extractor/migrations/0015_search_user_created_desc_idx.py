@@ -0,0 +1,19 @@
+# Índice para a consulta "últimas 3 pesquisas do usuário" (dedup e cleanup
+# de LeadAccess): ORDER BY created_at DESC com filtro por user vira um
+# index scan que retorna 3 linhas.
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lead_extractor', '0014_sociocpfenrichment'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='search',
+            index=models.Index(fields=['user', '-created_at'], name='search_user_created_desc_idx'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Índice para os prefetches de enriched_at por usuário na sanitização.
+# (user, lead) já tem índice único via unique_together; (lead, user) e
+# (search, user) já existiam.
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lead_extractor', '0015_search_user_created_desc_idx'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='leadaccess',
+            index=models.Index(fields=['user', 'enriched_at'], name='leadaccess_user_enriched_idx'),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Visão pública do viper_data denormalizada no Lead: cache-hits deixam de
+# sanitizar o mesmo JSON a cada busca. Leads antigos ficam com {} e os
+# leitores fazem fallback para sanitize_lead_data.
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lead_extractor', '0016_leadaccess_user_enriched_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='lead',
+            name='viper_data_public',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Troca o índice (cached_search, cnpj) por uma versão parcial: as queries de
+# seleção de cache sempre excluem cnpj nulo/vazio, então o índice fica menor
+# e o scan cobre só as linhas relevantes.
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lead_extractor', '0017_lead_viper_data_public'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='lead',
+            name='lead_extrac_cached__85a98e_idx',
+        ),
+        migrations.AddIndex(
+            model_name='lead',
+            index=models.Index(
+                condition=models.Q(('cnpj__isnull', False)) & ~models.Q(('cnpj', '')),
+                fields=['cached_search', 'cnpj'],
+                name='lead_cs_cnpj_notempty',
+            ),
+        ),
+    ]
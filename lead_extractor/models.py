@@ -111,6 +111,7 @@ class Search(models.Model):
         ordering = ['-created_at']
         indexes = [
             models.Index(fields=['user', 'status', 'created_at']),
+            models.Index(fields=['user', '-created_at'], name='search_user_created_desc_idx'),  # "Últimas 3 pesquisas" (dedup/cleanup)
         ]
 
     def __str__(self):
@@ -184,6 +185,11 @@ class Lead(models.Model):
     # Vamos salvar o retorno do Viper inteiro num campo JSON
     # Assim não precisamos criar 50 colunas agora. O Postgres/Supabase é ÓTIMO com JSON.
     viper_data = models.JSONField(null=True, blank=True)
+
+    # Visão pública (sem telefones/emails/QSA) pré-computada na escrita:
+    # cache-hits servem direto daqui sem sanitizar de novo. Vazio em leads
+    # antigos -> os leitores caem no sanitize_lead_data como fallback.
+    viper_data_public = models.JSONField(default=dict, blank=True)
     
     first_extracted_at = models.DateTimeField(default=timezone.now)
     created_at = models.DateTimeField(auto_now_add=True)
@@ -192,7 +198,13 @@ class Lead(models.Model):
         ordering = ['-created_at']
         indexes = [
             models.Index(fields=['cnpj']),
-            models.Index(fields=['cached_search', 'cnpj']),  # Para get_leads_from_cache otimizado
+            # Parcial: as queries de cache sempre filtram cnpj não-nulo e
+            # não-vazio, então o índice só precisa dessas linhas
+            models.Index(
+                fields=['cached_search', 'cnpj'],
+                name='lead_cs_cnpj_notempty',
+                condition=models.Q(cnpj__isnull=False) & ~models.Q(cnpj=''),
+            ),
         ]
 
     def __str__(self):
@@ -217,6 +229,7 @@ class LeadAccess(models.Model):
             models.Index(fields=['user', 'accessed_at']),
             models.Index(fields=['lead', 'user']),
             models.Index(fields=['search', 'user']),
+            models.Index(fields=['user', 'enriched_at'], name='leadaccess_user_enriched_idx'),  # Prefetch de enriched_at na sanitização
         ]
     
     def __str__(self):
@@ -9,6 +9,7 @@ from .search_service import (
 )
 from .serper_service import search_google_maps, find_cnpj_by_name
 from .viper_api import (
+    enrich_companies_viper,
     enrich_company_viper,
     get_partners_internal,
     get_partners_internal_queued,
@@ -38,6 +39,7 @@ __all__ = [
     'search_incremental',
     'search_google_maps',
     'find_cnpj_by_name',
+    'enrich_companies_viper',
     'enrich_company_viper',
     'get_partners_internal',
     'get_partners_internal_queued',
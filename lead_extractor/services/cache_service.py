@@ -3,6 +3,8 @@ Serviço de cache de buscas e leads. CachedSearch, NormalizedNiche, deduplicaç
 """
 import logging
 
+from django.db import transaction
+from django.db.models import Subquery
 from django.utils import timezone
 
 from lead_extractor.models import (
@@ -16,11 +18,24 @@ from lead_extractor.models import (
 )
 from lead_extractor.credit_service import debit_credits
 from lead_extractor.services.normalization import normalize_niche
-from lead_extractor.services.lead_sanitizer import sanitize_lead_data
+from lead_extractor.services.lead_sanitizer import sanitize_viper_data
 
 logger = logging.getLogger(__name__)
 
 
+def _viper_view(lead, lead_access):
+    """
+    Visão do viper_data conforme o acesso: enriquecido sanitiza na hora;
+    não enriquecido serve a coluna denormalizada viper_data_public
+    (com fallback para sanitizar leads antigos sem a coluna preenchida).
+    """
+    if lead_access is not None and lead_access.enriched_at is not None:
+        return sanitize_viper_data(lead['viper_data'], has_enriched_access=True)
+    if lead['viper_data_public']:
+        return lead['viper_data_public']
+    return sanitize_viper_data(lead['viper_data'])
+
+
 def get_or_create_normalized_niche(niche):
     """
     Busca ou cria um NormalizedNiche.
@@ -106,31 +121,36 @@ def create_cached_search(niche_normalized, location_normalized, total_leads):
     return cached
 
 
-def cleanup_old_search_accesses(user_profile):
+def cleanup_old_search_accesses(user_profile, last_search_ids=None):
     """
     Remove LeadAccess de pesquisas antigas (que não estão nas 3 últimas pesquisas).
     Isso torna os leads disponíveis novamente para o usuário em novas buscas.
 
     Args:
         user_profile: UserProfile do usuário
+        last_search_ids: IDs das 3 últimas pesquisas, se o chamador já os tem
+            (evita repetir a query na tabela Search)
 
     Returns:
         int: Número de LeadAccess deletados
     """
     try:
-        last_3_searches = Search.objects.filter(
-            user=user_profile
-        ).order_by('-created_at')[:3]
-
-        if not last_3_searches.exists():
+        if last_search_ids is None:
+            # Subquery: o banco resolve as 3 últimas pesquisas dentro do
+            # próprio DELETE, sem round-trip extra para materializar os ids
+            # (subquery vazia não exclui nada — sem pesquisas, sem acessos)
+            last_search_ids = Subquery(
+                Search.objects.filter(user=user_profile)
+                .order_by('-created_at')
+                .values('id')[:3]
+            )
+        elif not last_search_ids:
             return 0
 
-        last_3_search_ids = set(last_3_searches.values_list('id', flat=True))
-
         deleted_count = LeadAccess.objects.filter(
             user=user_profile,
             search__isnull=False
-        ).exclude(search_id__in=last_3_search_ids).delete()[0]
+        ).exclude(search_id__in=last_search_ids).delete()[0]
 
         logger.info(
             f"cleanup_old_search_accesses: deletados {deleted_count} LeadAccess de pesquisas antigas para usuário {user_profile.id}"
@@ -141,7 +161,7 @@ def cleanup_old_search_accesses(user_profile):
         return 0
 
 
-def get_cnpjs_from_user_last_3_searches(user_profile, exclude_search_id=None):
+def get_cnpjs_from_user_last_3_searches(user_profile, exclude_search_id=None, search_ids=None):
     """
     Retorna set de CNPJs que o usuário já viu nas últimas 3 pesquisas.
     Usado para deduplicação: não retornar o mesmo lead se está nas últimas 3 buscas.
@@ -149,21 +169,23 @@ def get_cnpjs_from_user_last_3_searches(user_profile, exclude_search_id=None):
     Args:
         user_profile: UserProfile do usuário
         exclude_search_id: ID da busca atual (excluir da contagem)
+        search_ids: IDs das pesquisas a considerar, se o chamador já os tem
+            (evita repetir a query na tabela Search)
 
     Returns:
         set: CNPJs a excluir da busca atual
     """
-    last_searches = Search.objects.filter(
-        user=user_profile
-    ).exclude(
-        id=exclude_search_id
-    ).order_by('-created_at')[:3]
+    if search_ids is None:
+        search_ids = list(
+            Search.objects.filter(user=user_profile)
+            .exclude(id=exclude_search_id)
+            .order_by('-created_at')
+            .values_list('id', flat=True)[:3]
+        )
 
-    if not last_searches:
+    if not search_ids:
         return set()
 
-    search_ids = [s.id for s in last_searches]
-
     cnpjs_from_searchlead = set(
         SearchLead.objects.filter(search_id__in=search_ids)
         .values_list('lead__cnpj', flat=True)
@@ -191,16 +213,27 @@ def get_existing_leads_from_db(niche_normalized, location_normalized, quantity,
         search_obj: Objeto Search (opcional, para vincular LeadAccess)
 
     Returns:
-        tuple: (lista de leads encontrados, cached_search criado/atualizado)
+        tuple: (lista de leads encontrados, cached_search criado/atualizado,
+            créditos debitados nesta chamada)
     """
     if not niche_normalized or not location_normalized:
-        return [], None
+        return [], None, 0
 
     try:
-        cleanup_old_search_accesses(user_profile)
+        # "3 últimas pesquisas" resolvido uma vez: a limpeza considera as 3
+        # mais recentes (incluindo a atual), a deduplicação as 3 anteriores
+        current_search_id = search_obj.id if search_obj else None
+        last_search_ids = list(
+            Search.objects.filter(user=user_profile)
+            .order_by('-created_at')
+            .values_list('id', flat=True)[:4]
+        )
+
+        cleanup_old_search_accesses(user_profile, last_search_ids=last_search_ids[:3])
 
         exclude_cnpjs = get_cnpjs_from_user_last_3_searches(
-            user_profile, exclude_search_id=search_obj.id if search_obj else None
+            user_profile,
+            search_ids=[i for i in last_search_ids if i != current_search_id][:3],
         )
 
         cached_search = get_cached_search(niche_normalized, location_normalized)
@@ -211,78 +244,93 @@ def get_existing_leads_from_db(niche_normalized, location_normalized, quantity,
                 cnpj__isnull=False
             ).exclude(cnpj='')
         else:
-            return [], None
+            return [], None, 0
 
+        # .values() evita hidratar instâncias de Lead: só estes campos são lidos.
+        # iterator() streama em chunks: como o dedup abaixo para em quantity,
+        # raramente o slice inteiro (com viper_data grande) chega à memória
         available_leads = leads_query.exclude(
             cnpj__in=exclude_cnpjs
-        ).order_by('-created_at')[:quantity * 3]
+        ).order_by('-created_at').values(
+            'id', 'cnpj', 'name', 'address', 'phone_maps', 'viper_data', 'viper_data_public'
+        )[:quantity * 3].iterator(chunk_size=50)
 
-        results = []
+        # Dedup por CNPJ preservando a ordem, truncado em quantity
+        selected = []
         cnpjs_processed = set()
-
         for lead in available_leads:
-            if len(results) >= quantity:
+            if len(selected) >= quantity:
                 break
-
-            cnpj = lead.cnpj
-
-            if cnpj in cnpjs_processed:
+            if lead['cnpj'] in cnpjs_processed:
                 continue
-            cnpjs_processed.add(cnpj)
-
-            skip_debit = bool(search_obj and search_obj.search_data.get('onboarding'))
-            credits_to_set = 0 if skip_debit else 1
-            lead_access, created = LeadAccess.objects.get_or_create(
-                user=user_profile,
-                lead=lead,
-                defaults={
-                    'search': search_obj,
-                    'credits_paid': credits_to_set,
-                }
+            cnpjs_processed.add(lead['cnpj'])
+            selected.append(lead)
+
+        skip_debit = bool(search_obj and search_obj.search_data.get('onboarding'))
+        credits_to_set = 0 if skip_debit else 1
+
+        # Acessos existentes em uma query; os novos vão num único INSERT e
+        # o débito de créditos acontece uma vez para o lote inteiro
+        access_map = {
+            la.lead_id: la
+            for la in LeadAccess.objects.filter(
+                user=user_profile, lead_id__in=[lead['id'] for lead in selected]
             )
-
-            if created and not skip_debit:
+        }
+        new_accesses = [
+            LeadAccess(user=user_profile, lead_id=lead['id'], search=search_obj, credits_paid=credits_to_set)
+            for lead in selected if lead['id'] not in access_map
+        ]
+
+        # Uma transação para o lote inteiro: um COMMIT em vez de um por INSERT.
+        # Débito ANTES do bulk_create (mesma ordem do ramo Serper): se o
+        # débito falhar, os leads novos são retidos em vez de entregues de
+        # graça com acessos marcados como pagos.
+        credits_debited = 0
+        with transaction.atomic():
+            if new_accesses and not skip_debit:
                 success, new_balance, error = debit_credits(
                     user_profile,
-                    1,
-                    description=f"Lead (base existente): {lead.name}"
+                    len(new_accesses),
+                    description=f"{len(new_accesses)} lead(s) (base existente)"
+                )
+                if success:
+                    credits_debited = len(new_accesses)
+                else:
+                    logger.warning(f"Erro ao debitar créditos de {len(new_accesses)} leads: {error}")
+                    new_accesses = []
+
+            if new_accesses:
+                LeadAccess.objects.bulk_create(new_accesses, ignore_conflicts=True)
+                for lead_access in new_accesses:
+                    access_map[lead_access.lead_id] = lead_access
+
+            # Só entregar leads com acesso (pré-existente ou recém-pago)
+            delivered = [lead for lead in selected if lead['id'] in access_map]
+
+            if search_obj and delivered:
+                SearchLead.objects.bulk_create(
+                    [SearchLead(search=search_obj, lead_id=lead['id']) for lead in delivered],
+                    ignore_conflicts=True
                 )
-                if not success:
-                    logger.warning(f"Erro ao debitar crédito para lead {lead.id}: {error}")
-
-            if search_obj:
-                SearchLead.objects.get_or_create(search=search_obj, lead=lead)
-
-            sanitized_viper_data = sanitize_lead_data(
-                {'viper_data': lead.viper_data or {}},
-                show_partners=(lead_access.enriched_at is not None)
-            ).get('viper_data', {})
-
-            company_data = {
-                'name': lead.name,
-                'address': lead.address,
-                'phone_maps': lead.phone_maps,
-                'cnpj': cnpj,
-                'viper_data': sanitized_viper_data
-            }
-
-            results.append(company_data)
-
-        if results and cached_search:
-            total_leads = Lead.objects.filter(
-                cached_search=cached_search,
-                cnpj__isnull=False
-            ).exclude(cnpj='').values('cnpj').distinct().count()
 
-            if cached_search.total_leads_cached != total_leads:
-                cached_search.total_leads_cached = total_leads
-                cached_search.save(update_fields=['total_leads_cached', 'last_updated'])
+        results = []
+        for lead in delivered:
+            sanitized_viper_data = _viper_view(lead, access_map.get(lead['id']))
+
+            results.append({
+                'name': lead['name'],
+                'address': lead['address'],
+                'phone_maps': lead['phone_maps'],
+                'cnpj': lead['cnpj'],
+                'viper_data': sanitized_viper_data
+            })
 
         logger.info(f"get_existing_leads_from_db: retornando {len(results)} leads da base (solicitado: {quantity})")
-        return results, cached_search
+        return results, cached_search, credits_debited
     except Exception as e:
         logger.error(f"Erro ao buscar leads existentes na base: {e}", exc_info=True)
-        return [], None
+        return [], None, 0
 
 
 def get_leads_from_cache(cached_search, user_profile, quantity, search_obj=None, extra_exclude_cnpjs=None):
@@ -299,10 +347,11 @@ def get_leads_from_cache(cached_search, user_profile, quantity, search_obj=None,
         extra_exclude_cnpjs: set ou iterable de CNPJs a excluir
 
     Returns:
-        list: Lista de leads do cache (formato dict como no dashboard)
+        tuple: (lista de leads do cache no formato dict do dashboard,
+            créditos debitados nesta chamada)
     """
     if not cached_search:
-        return []
+        return [], 0
 
     try:
         exclude_cnpjs = set(get_cnpjs_from_user_last_3_searches(
@@ -310,118 +359,148 @@ def get_leads_from_cache(cached_search, user_profile, quantity, search_obj=None,
         ))
         if extra_exclude_cnpjs:
             exclude_cnpjs.update(extra_exclude_cnpjs)
-        accessed_cnpjs = set(
-            LeadAccess.objects.filter(user=user_profile)
-            .values_list('lead__cnpj', flat=True)
-        )
 
+        # .values() evita hidratar instâncias de Lead: só estes campos são lidos.
+        # iterator() streama em chunks: o dedup abaixo para em quantity, então
+        # o slice inteiro raramente é materializado
         cached_leads_new = Lead.objects.filter(
             cached_search=cached_search,
             cnpj__isnull=False
-        ).exclude(cnpj='').exclude(cnpj__in=exclude_cnpjs).order_by('-created_at')[:quantity * 3]
+        ).exclude(cnpj='').exclude(cnpj__in=exclude_cnpjs).order_by('-created_at').values(
+            'id', 'cnpj', 'name', 'address', 'phone_maps', 'viper_data', 'viper_data_public'
+        )[:quantity * 3].iterator(chunk_size=50)
 
-        results = []
+        # Dedup por CNPJ preservando a ordem, truncado em quantity
+        selected = []
         cnpjs_processed = set()
-
         for lead in cached_leads_new:
-            if len(results) >= quantity:
+            if len(selected) >= quantity:
                 break
-
-            cnpj = lead.cnpj
-
-            if cnpj in cnpjs_processed:
+            if lead['cnpj'] in cnpjs_processed:
                 continue
-            cnpjs_processed.add(cnpj)
-
-            skip_debit = bool(search_obj and search_obj.search_data.get('onboarding'))
-            credits_to_set = 0 if skip_debit else 1
-            lead_access, created = LeadAccess.objects.get_or_create(
-                user=user_profile,
-                lead=lead,
-                defaults={
-                    'search': search_obj,
-                    'credits_paid': credits_to_set,
-                }
+            cnpjs_processed.add(lead['cnpj'])
+            selected.append(lead)
+
+        skip_debit = bool(search_obj and search_obj.search_data.get('onboarding'))
+        credits_to_set = 0 if skip_debit else 1
+
+        # Mesma estratégia de get_existing_leads_from_db: uma query de acessos,
+        # um INSERT em lote e um único débito de créditos
+        access_map = {
+            la.lead_id: la
+            for la in LeadAccess.objects.filter(
+                user=user_profile, lead_id__in=[lead['id'] for lead in selected]
             )
-
-            if created and not skip_debit:
+        }
+        new_accesses = [
+            LeadAccess(user=user_profile, lead_id=lead['id'], search=search_obj, credits_paid=credits_to_set)
+            for lead in selected if lead['id'] not in access_map
+        ]
+
+        # Uma transação para o lote inteiro: um COMMIT em vez de um por INSERT.
+        # Débito ANTES do bulk_create (mesma ordem do ramo Serper): se o
+        # débito falhar, os leads novos são retidos em vez de entregues de
+        # graça com acessos marcados como pagos.
+        credits_debited = 0
+        with transaction.atomic():
+            if new_accesses and not skip_debit:
                 success, new_balance, error = debit_credits(
                     user_profile,
-                    1,
-                    description=f"Lead (cache): {lead.name}"
+                    len(new_accesses),
+                    description=f"{len(new_accesses)} lead(s) (cache)"
+                )
+                if success:
+                    credits_debited = len(new_accesses)
+                else:
+                    logger.warning(f"Erro ao debitar créditos de {len(new_accesses)} leads: {error}")
+                    new_accesses = []
+
+            if new_accesses:
+                LeadAccess.objects.bulk_create(new_accesses, ignore_conflicts=True)
+                for lead_access in new_accesses:
+                    access_map[lead_access.lead_id] = lead_access
+
+            # Só entregar leads com acesso (pré-existente ou recém-pago)
+            delivered = [lead for lead in selected if lead['id'] in access_map]
+
+            if search_obj and delivered:
+                SearchLead.objects.bulk_create(
+                    [SearchLead(search=search_obj, lead_id=lead['id']) for lead in delivered],
+                    ignore_conflicts=True
                 )
-                if not success:
-                    logger.warning(f"Erro ao debitar crédito para lead {lead.id}: {error}")
-
-            if search_obj:
-                SearchLead.objects.get_or_create(search=search_obj, lead=lead)
-
-            sanitized_viper_data = sanitize_lead_data(
-                {'viper_data': lead.viper_data or {}},
-                show_partners=(lead_access.enriched_at is not None)
-            ).get('viper_data', {})
-
-            company_data = {
-                'name': lead.name,
-                'address': lead.address,
-                'phone_maps': lead.phone_maps,
-                'cnpj': cnpj,
-                'viper_data': sanitized_viper_data
-            }
 
-            results.append(company_data)
+        results = []
+        for lead in delivered:
+            sanitized_viper_data = _viper_view(lead, access_map.get(lead['id']))
+
+            results.append({
+                'name': lead['name'],
+                'address': lead['address'],
+                'phone_maps': lead['phone_maps'],
+                'cnpj': lead['cnpj'],
+                'viper_data': sanitized_viper_data
+            })
 
         if len(results) < quantity:
             additional_needed = quantity - len(results)
+            # Semi-join em LeadAccess em vez de materializar todos os CNPJs
+            # acessados do usuário num IN gigante; (user, lead) é único,
+            # então o join não duplica linhas e dispensa distinct()
             cached_leads_accessed = Lead.objects.filter(
                 cached_search=cached_search,
                 cnpj__isnull=False,
-                cnpj__in=accessed_cnpjs
-            ).exclude(cnpj='').exclude(cnpj__in=cnpjs_processed).exclude(cnpj__in=exclude_cnpjs).order_by('-created_at')[:additional_needed * 2]
+                accesses__user=user_profile
+            ).exclude(cnpj='').exclude(cnpj__in=cnpjs_processed).exclude(cnpj__in=exclude_cnpjs).order_by('-created_at').values(
+                'id', 'cnpj', 'name', 'address', 'phone_maps', 'viper_data', 'viper_data_public'
+            )[:additional_needed * 2].iterator(chunk_size=50)
 
+            # Dedup por CNPJ preservando a ordem, truncado no que falta
+            reused = []
             for lead in cached_leads_accessed:
-                if len(results) >= quantity:
+                if len(results) + len(reused) >= quantity:
                     break
-
-                cnpj = lead.cnpj
-
-                if cnpj in cnpjs_processed:
+                if lead['cnpj'] in cnpjs_processed:
                     continue
-                cnpjs_processed.add(cnpj)
-
-                lead_access = LeadAccess.objects.filter(
-                    user=user_profile,
-                    lead=lead
-                ).first()
-
-                if not lead_access:
-                    lead_access = LeadAccess.objects.create(
-                        user=user_profile,
-                        lead=lead,
-                        search=search_obj,
-                        credits_paid=0
+                cnpjs_processed.add(lead['cnpj'])
+                reused.append(lead)
+
+            # Acessos pré-carregados em uma query (em vez de filter().first()
+            # por lead); leads reusados sem acesso ganham um com credits_paid=0
+            reused_access_map = {
+                la.lead_id: la
+                for la in LeadAccess.objects.filter(
+                    user=user_profile, lead_id__in=[lead['id'] for lead in reused]
+                )
+            }
+            missing_accesses = [
+                LeadAccess(user=user_profile, lead_id=lead['id'], search=search_obj, credits_paid=0)
+                for lead in reused if lead['id'] not in reused_access_map
+            ]
+            with transaction.atomic():
+                if missing_accesses:
+                    LeadAccess.objects.bulk_create(missing_accesses, ignore_conflicts=True)
+                    for lead_access in missing_accesses:
+                        reused_access_map[lead_access.lead_id] = lead_access
+
+                if search_obj and reused:
+                    SearchLead.objects.bulk_create(
+                        [SearchLead(search=search_obj, lead_id=lead['id']) for lead in reused],
+                        ignore_conflicts=True
                     )
 
-                if search_obj:
-                    SearchLead.objects.get_or_create(search=search_obj, lead=lead)
+            for lead in reused:
+                sanitized_viper_data = _viper_view(lead, reused_access_map.get(lead['id']))
 
-                sanitized_viper_data = sanitize_lead_data(
-                    {'viper_data': lead.viper_data or {}},
-                    show_partners=(lead_access.enriched_at is not None)
-                ).get('viper_data', {})
-
-                company_data = {
-                    'name': lead.name,
-                    'address': lead.address,
-                    'phone_maps': lead.phone_maps,
-                    'cnpj': cnpj,
+                results.append({
+                    'name': lead['name'],
+                    'address': lead['address'],
+                    'phone_maps': lead['phone_maps'],
+                    'cnpj': lead['cnpj'],
                     'viper_data': sanitized_viper_data
-                }
-
-                results.append(company_data)
+                })
 
         logger.info(f"get_leads_from_cache: retornando {len(results)} leads do cache (solicitado: {quantity})")
-        return results
+        return results, credits_debited
     except Exception as e:
         logger.error(f"Erro ao buscar leads do cache: {e}", exc_info=True)
-        return []
+        return [], 0
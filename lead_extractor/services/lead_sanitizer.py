@@ -1,15 +1,62 @@
 """
 Sanitização de dados de leads. Remove dados sensíveis até enriquecimento pago.
 """
-import copy
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Chaves do viper_data que só aparecem após enriquecimento pago
+_ENRICHED_ONLY_KEYS = frozenset({'telefones', 'emails', 'socios_qsa'})
+
+
+def build_public_viper_data(viper_data):
+    """
+    Visão pública (não enriquecida) do viper_data, para denormalizar em
+    Lead.viper_data_public nos caminhos de escrita.
+    """
+    if not viper_data:
+        return {}
+    return {
+        key: value
+        for key, value in viper_data.items()
+        if key != 'enderecos' and key not in _ENRICHED_ONLY_KEYS
+    }
+
+
+def sanitize_viper_data(viper_data, has_enriched_access=False):
+    """
+    Sanitiza um viper_data direto, sem o wrapper de lead_data. REGRA CRÍTICA:
+    Sócios/telefones/emails só aparecem após enriquecimento pago.
+
+    Entrada principal para os hot paths que já têm o viper_data em mãos:
+    evita embrulhar em {'viper_data': ...} e desembrulhar de volta (duas
+    alocações de dict por lead que se acumulam em lotes grandes).
+
+    A cópia é rasa: a função apenas descarta chaves, então os valores
+    mantidos são compartilhados com a entrada e não devem ser mutados pelo
+    chamador.
+
+    Args:
+        viper_data: Dict com os dados do Viper (pode ser vazio/None)
+        has_enriched_access: Se True, mostra dados enriquecidos (QSA, telefones, emails) - verifica LeadAccess.enriched_at
+
+    Returns:
+        dict: viper_data sanitizado
+    """
+    if not viper_data:
+        return {}
+    # 'enderecos' nunca é exposto, independente de enriquecimento
+    return {
+        key: value
+        for key, value in viper_data.items()
+        if key != 'enderecos' and (has_enriched_access or key not in _ENRICHED_ONLY_KEYS)
+    }
+
 
 def sanitize_lead_data(lead_data, show_partners=False, has_enriched_access=False):
     """
-    Remove dados sensíveis de leads. REGRA CRÍTICA: Sócios/telefones/emails só aparecem após enriquecimento pago.
+    Remove dados sensíveis de leads. Wrapper fino sobre sanitize_viper_data
+    para chamadores que trabalham com o dict completo do lead.
 
     Args:
         lead_data: Dict com dados do lead (formato do dashboard)
@@ -19,22 +66,14 @@ def sanitize_lead_data(lead_data, show_partners=False, has_enriched_access=False
     Returns:
         dict: Dados sanitizados
     """
-    sanitized = copy.deepcopy(lead_data)
-
     if show_partners and not has_enriched_access:
         has_enriched_access = True
 
-    if 'viper_data' in sanitized and sanitized['viper_data']:
-        viper_data = sanitized['viper_data'].copy()
-
-        if not has_enriched_access:
-            viper_data.pop('telefones', None)
-            viper_data.pop('emails', None)
-
-        if not has_enriched_access:
-            viper_data.pop('socios_qsa', None)
+    sanitized = dict(lead_data)
 
-        viper_data.pop('enderecos', None)
-        sanitized['viper_data'] = viper_data
+    if sanitized.get('viper_data'):
+        sanitized['viper_data'] = sanitize_viper_data(
+            sanitized['viper_data'], has_enriched_access=has_enriched_access
+        )
 
     return sanitized
@@ -1,3 +1,4 @@
+import functools
 import re
 import unicodedata
 import logging
@@ -6,25 +7,45 @@ from lead_extractor.models import NormalizedLocation
 
 logger = logging.getLogger(__name__)
 
+# Tabela pré-computada (uma vez, no import) que descarta marcas combinantes
+# (acentos) após NFKD. str.translate com chaves int é ~2x mais rápido que
+# filtrar caractere a caractere com unicodedata.combining no loop.
+_COMBINING_TABLE = dict.fromkeys(
+    c for c in range(0x10000) if unicodedata.combining(chr(c))
+)
+
+# "Cidade - UF" (hífen com espaços opcionais); pré-compilada porque
+# normalize_location roda para cada busca
+_LOCATION_RE = re.compile(r'^(.+?)\s*-\s*([A-Z]{2})$')
+
 
 def remove_accents(text):
     """
     Remove acentos de uma string.
-    
+
+    Strings puramente ASCII (caso comum em nichos) retornam direto,
+    sem pagar a normalização NFKD.
+
     Args:
         text: String a ser normalizada
-    
+
     Returns:
         str: String sem acentos
     """
+    if text.isascii():
+        return text
     nfkd = unicodedata.normalize('NFKD', text)
-    return ''.join([c for c in nfkd if not unicodedata.combining(c)])
+    return nfkd.translate(_COMBINING_TABLE)
 
 
+@functools.lru_cache(maxsize=2048)
 def normalize_niche(niche):
     """
     Normaliza um nicho para formato padrão.
-    
+
+    Memoizada: o conjunto de nichos distintos é pequeno (centenas) e a
+    normalização (NFKD + split/join) é cara para repetir a cada lead.
+
     Args:
         niche: String do nicho (ex: "Advogado", "advogado", "ADVOGADO")
     
@@ -44,10 +65,16 @@ def normalize_niche(niche):
     return normalized
 
 
+@functools.lru_cache(maxsize=8192)
 def normalize_location(location):
     """
     Normaliza uma localização para formato "Cidade - UF".
-    
+
+    Memoizada: além do parse, cada chamada faz um lookup em
+    NormalizedLocation. A tabela é essencialmente estática (populada por
+    populate_normalized_data / load_brazil_cities); após repopular, use
+    normalize_location.cache_clear() ou reinicie os workers.
+
     Args:
         location: String da localização (ex: "São Paulo", "são paulo - sp", "SAO PAULO-SP")
     
@@ -62,7 +89,7 @@ def normalize_location(location):
     
     # Tentar diferentes formatos de entrada
     # Formato 1: "Cidade - UF" ou "Cidade -UF" ou "Cidade- UF"
-    match = re.match(r'^(.+?)\s*-\s*([A-Z]{2})$', location.upper())
+    match = _LOCATION_RE.match(location.upper())
     if match:
         city = match.group(1).strip()
         state = match.group(2).strip()
@@ -88,9 +115,6 @@ def normalize_location(location):
             return f"{city_formatted} - {state}"
     except Exception as e:
         logger.error(f"Erro ao normalizar localização '{location}': {e}", exc_info=True)
-        # Fallback: retornar formato padrão
-        city_formatted = city.title() if 'city' in locals() else location.title()
-        state_formatted = state if 'state' in locals() else ''
-        if state_formatted:
-            return f"{city_formatted} - {state_formatted}"
-        return None
\ No newline at end of file
+        # Fallback: retornar formato padrão (city/state sempre definidos aqui:
+        # o único caminho sem match já retornou None antes do try)
+        return f"{city.title()} - {state}"
\ No newline at end of file
@@ -3,10 +3,13 @@ Orquestração de busca: filter_existing_leads, search_incremental, process_sear
 """
 import logging
 import re
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
+from django.db import connection, transaction
+from django.db.models import F
 from django.utils import timezone
 
-from lead_extractor.models import Lead, Search, SearchLead, LeadAccess
+from lead_extractor.models import CachedSearch, Lead, Search, SearchLead, LeadAccess
 from lead_extractor.credit_service import debit_credits
 from lead_extractor.services.serper_service import (
     search_google_maps_paginated,
@@ -15,6 +18,7 @@ from lead_extractor.services.serper_service import (
     _normalize_company_name_for_cache,
 )
 from lead_extractor.services.viper_api import (
+    enrich_companies_viper,
     enrich_company_viper,
     get_partners_internal,
     search_cpf_viper,
@@ -22,39 +26,143 @@ from lead_extractor.services.viper_api import (
 )
 from lead_extractor.services.normalization import normalize_niche, normalize_location
 from lead_extractor.services.cache_service import (
-    get_cached_search,
     create_cached_search,
     get_existing_leads_from_db,
     get_leads_from_cache,
     get_cnpjs_from_user_last_3_searches,
 )
-from lead_extractor.services.lead_sanitizer import sanitize_lead_data
+from lead_extractor.services.lead_sanitizer import build_public_viper_data
 
 logger = logging.getLogger(__name__)
 
 
 def filter_existing_leads(user_profile, new_places):
     """
-    Retorna lugares do Google Maps e CNPJs globais existentes.
-    NÃO faz buscas no Serper - apenas retorna dados para processamento posterior.
+    Retorna lugares do Google Maps para processamento posterior.
+    NÃO faz buscas no Serper.
+
+    Mantida por compatibilidade de assinatura: a checagem de CNPJs já
+    existentes na base deixou de carregar a coluna inteira de CNPJs e agora
+    é scoped por lote resolvido (ver get_existing_global_cnpjs).
 
     Args:
         user_profile: Objeto UserProfile (não usado, mantido para compatibilidade)
         new_places: Lista de lugares retornados pelo Google Maps
 
     Returns:
-        tuple: (filtered_places: list, existing_cnpjs: set)
+        tuple: (filtered_places: list, existing_cnpjs: set vazio)
     """
     if not new_places:
         return [], set()
+    return new_places, set()
+
 
-    global_cnpjs = set(
-        Lead.objects.exclude(cnpj__isnull=True)
-        .exclude(cnpj='')
-        .values_list('cnpj', flat=True)
+def get_existing_global_cnpjs(cnpjs):
+    """
+    Subconjunto de `cnpjs` que já existe na base global, em uma única query
+    scoped (cnpj__in=...). Substitui o antigo SELECT da coluna inteira de
+    CNPJs, que crescia com a base e rodava a cada chamada.
+    """
+    cnpjs = {cnpj for cnpj in cnpjs if cnpj}
+    if not cnpjs:
+        return set()
+    return set(
+        Lead.objects.filter(cnpj__in=cnpjs).values_list('cnpj', flat=True)
     )
 
-    return new_places, global_cnpjs
+
+def _leads_by_cnpj(cnpjs, fields):
+    """
+    Mapa cnpj -> Lead para um lote, em uma query scoped.
+
+    in_bulk(field_name='cnpj') não serve aqui: Lead.cnpj não é único (a
+    base mantém múltiplas linhas por CNPJ e o in_bulk exige campo unique).
+    Em caso de duplicata vence a linha mais recente — mesmo critério
+    newest-first dos caminhos de leitura do cache.
+
+    Args:
+        cnpjs: Iterable de CNPJs do lote
+        fields: Campos a carregar (passados ao only())
+
+    Returns:
+        dict: cnpj -> instância de Lead (parcial, só com `fields`)
+    """
+    return {
+        lead.cnpj: lead
+        for lead in Lead.objects.filter(cnpj__in=cnpjs)
+        .only(*fields)
+        .order_by('created_at')
+    }
+
+
+def enrich_places(places, location=None, cnpj_cache=None, skip_cnpjs=None, max_workers=12):
+    """
+    Resolve CNPJ (Serper) e dados públicos (Viper) de um lote de places em paralelo.
+
+    Cada place envolve 1-2 round-trips HTTP de 100-500ms e o trabalho é
+    independente entre places, então um pool de threads reduz o tempo do lote
+    de N*RTT para ~RTT. O QSA (API interna do Viper) fica de fora: é
+    serializado pela fila ViperRequestQueue por design.
+
+    Args:
+        places: Lista de places (dicts com 'title')
+        location: Localização para desambiguar CNPJ por nome
+        cnpj_cache: Dict name_key -> cnpj compartilhado com o chamador;
+            é consultado e atualizado (evita repetir buscas no Serper)
+        skip_cnpjs: CNPJs que o chamador vai descartar (duplicados); para
+            esses não vale a pena gastar uma chamada de enriquecimento
+        max_workers: Número máximo de threads do pool
+
+    Returns:
+        tuple: (dict name_key -> (cnpj ou None, dados públicos do Viper ou None),
+            set de CNPJs resolvidos que já existiam na base global)
+    """
+    if not places:
+        return {}, set()
+    if cnpj_cache is None:
+        cnpj_cache = {}
+    if skip_cnpjs is None:
+        skip_cnpjs = set()
+
+    # Fase 1: resolver os CNPJs que não estão no cache, em paralelo (Serper)
+    resolved = {}
+    pending = {}
+    for place in places:
+        title = place.get('title', '')
+        name_key = _normalize_company_name_for_cache(title)
+        if not name_key or name_key in resolved or name_key in pending:
+            continue
+        if name_key in cnpj_cache:
+            resolved[name_key] = cnpj_cache[name_key]
+        else:
+            pending[name_key] = title
+
+    if pending:
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(pending))) as executor:
+            futures = {
+                executor.submit(find_cnpj_by_name, title, location=location): name_key
+                for name_key, title in pending.items()
+            }
+            for future in as_completed(futures):
+                name_key = futures[future]
+                cnpj = future.result()
+                cnpj_cache[name_key] = cnpj
+                resolved[name_key] = cnpj
+
+    # Fase 2: enriquecer o lote de CNPJs válidos de uma vez (Viper),
+    # pulando os que o chamador vai descartar como duplicados e os que já
+    # existem na base global (checagem scoped por lote)
+    existing_global = get_existing_global_cnpjs(resolved.values())
+    to_enrich = [
+        cnpj for cnpj in resolved.values()
+        if cnpj and cnpj not in skip_cnpjs and cnpj not in existing_global
+    ]
+    enriched = enrich_companies_viper(to_enrich, max_workers=max_workers)
+
+    return {
+        name_key: (cnpj, enriched.get(cnpj))
+        for name_key, cnpj in resolved.items()
+    }, existing_global
 
 
 def search_incremental(search_term, user_profile, quantity, existing_cnpjs, location=None):
@@ -75,34 +183,47 @@ def search_incremental(search_term, user_profile, quantity, existing_cnpjs, loca
     cnpj_cache = {}
     MAX_SERPER_CALLS = 50
     MAX_ITERATIONS_WITHOUT_NEW = 10
-    serper_calls = 0
+    CNPJ_LOOKUP_WORKERS = 10
     iterations_without_new = 0
 
     max_results = min(quantity * 3, 50)
-    places = search_google_maps_paginated(search_term, max_results, max_pages=5)
-
-    filtered_places, global_cnpjs = filter_existing_leads(user_profile, places)
-    existing_cnpjs.update(global_cnpjs)
+    filtered_places = search_google_maps_paginated(search_term, max_results, max_pages=5)
 
+    # Fase 1: resolver os CNPJs em paralelo (cada lookup é um round-trip
+    # HTTPS independente), respeitando o teto de chamadas ao Serper
+    pending = {}
+    for place in filtered_places:
+        company_name = place.get('title', '')
+        name_key = _normalize_company_name_for_cache(company_name)
+        if name_key and name_key not in pending:
+            pending[name_key] = company_name
+
+    to_lookup = list(pending.items())[:MAX_SERPER_CALLS]
+    serper_calls = len(to_lookup)
+    if len(pending) > MAX_SERPER_CALLS:
+        logger.warning(f"Limite de chamadas ao Serper atingido ({MAX_SERPER_CALLS}) na busca incremental. Ignorando {len(pending) - MAX_SERPER_CALLS} nomes.")
+
+    if to_lookup:
+        with ThreadPoolExecutor(max_workers=min(CNPJ_LOOKUP_WORKERS, len(to_lookup))) as executor:
+            futures = {
+                executor.submit(find_cnpj_by_name, company_name, location=location): name_key
+                for name_key, company_name in to_lookup
+            }
+            for future in as_completed(futures):
+                cnpj_cache[futures[future]] = future.result()
+
+    # Checagem scoped: quais dos CNPJs resolvidos já existem na base global
+    existing_cnpjs.update(get_existing_global_cnpjs(cnpj_cache.values()))
+
+    # Fase 2: dedup/seleção em loop puro, sem I/O
     new_places = []
     for place in filtered_places:
-        if serper_calls >= MAX_SERPER_CALLS:
-            logger.warning(f"Limite de chamadas ao Serper atingido ({MAX_SERPER_CALLS}) na busca incremental. Parando busca.")
-            break
-
         if iterations_without_new >= MAX_ITERATIONS_WITHOUT_NEW:
             logger.info(f"Limite de iterações sem novos leads atingido ({MAX_ITERATIONS_WITHOUT_NEW}) na busca incremental. Parando busca.")
             break
 
-        company_name = place.get('title', '')
-        name_key = _normalize_company_name_for_cache(company_name)
-
-        if name_key in cnpj_cache:
-            cnpj = cnpj_cache[name_key]
-        else:
-            cnpj = find_cnpj_by_name(company_name, location=location)
-            serper_calls += 1
-            cnpj_cache[name_key] = cnpj
+        name_key = _normalize_company_name_for_cache(place.get('title', ''))
+        cnpj = cnpj_cache.get(name_key)
 
         if cnpj and cnpj not in existing_cnpjs:
             new_places.append(place)
@@ -126,12 +247,23 @@ def process_search_async(search_id):
         search_id: ID do objeto Search a processar
     """
     try:
-        search_obj = Search.objects.get(id=search_id)
-        user_profile = search_obj.user
-
-        search_obj.status = 'processing'
-        search_obj.processing_started_at = timezone.now()
-        search_obj.save(update_fields=['status', 'processing_started_at'])
+        # Claim exclusivo da linha: evita que duas threads/workers processem a
+        # mesma busca e dupliquem débitos. Com skip_locked (quando o banco
+        # suporta), uma linha já lockada aparece como inexistente e o worker
+        # concorrente desiste em silêncio.
+        with transaction.atomic():
+            try:
+                search_obj = Search.objects.select_for_update(
+                    skip_locked=connection.features.has_select_for_update_skip_locked
+                ).get(id=search_id)
+            except Search.DoesNotExist:
+                logger.info(f"Busca {search_id} inexistente ou já em processamento por outro worker; ignorando.")
+                return
+
+            user_profile = search_obj.user
+            search_obj.status = 'processing'
+            search_obj.processing_started_at = timezone.now()
+            search_obj.save(update_fields=['status', 'processing_started_at'])
 
         niche = search_obj.niche
         location = search_obj.location
@@ -146,41 +278,40 @@ def process_search_async(search_id):
 
         credits_used = 0
         leads_processed = 0
+        cache_leads_delta = 0
+        # Campos do Search acumulados ao longo da função e gravados num único
+        # UPDATE terminal, em vez de um save(update_fields=...) por etapa
+        search_updates = {}
         existing_cnpjs = get_cnpjs_from_user_last_3_searches(user_profile, exclude_search_id=search_id)
-        results = []
+        # Só a projeção (name/cnpj) é acumulada: ninguém lê o payload completo
+        # dos leads entregues (results_data só guarda o resumo e o dashboard
+        # lê direto de Lead/LeadAccess), então não há por que manter a lista
+        # gorda com viper_data em memória até o fim da busca
+        results_summary = []
         cached_search = None
+        places = []
 
         if niche_normalized and location_normalized:
-            existing_leads, cached_search = get_existing_leads_from_db(
+            existing_leads, cached_search, credits_debited = get_existing_leads_from_db(
                 niche_normalized, location_normalized, quantity, user_profile, search_obj
             )
 
             if existing_leads:
+                # O helper já contabiliza os débitos: sem lookup de LeadAccess por lead
+                credits_used += credits_debited
                 for company_data in existing_leads:
                     cnpj = company_data.get('cnpj')
                     if cnpj:
-                        lead_access = LeadAccess.objects.filter(
-                            user=user_profile,
-                            lead__cnpj=cnpj,
-                            search=search_obj
-                        ).first()
-
-                        if lead_access and lead_access.credits_paid > 0:
-                            credits_used += 1
-
                         existing_cnpjs.add(cnpj)
 
                     leads_processed += 1
-                    results.append(company_data)
+                    results_summary.append({'name': company_data['name'], 'cnpj': company_data.get('cnpj')})
 
                 logger.info(f"Leads existentes encontrados: {leads_processed} leads retornados da base (solicitado: {quantity})")
-                search_obj.results_count = SearchLead.objects.filter(search=search_obj).count()
-                search_obj.credits_used = credits_used
-                search_obj.save(update_fields=['results_count', 'credits_used'])
 
         if cached_search:
             search_obj.cached_search = cached_search
-            search_obj.save(update_fields=['cached_search'])
+            search_updates['cached_search'] = cached_search
 
         if leads_processed >= quantity:
             logger.info(f"Leads suficientes encontrados na base ({leads_processed}). Não fazendo busca no Serper.")
@@ -189,7 +320,6 @@ def process_search_async(search_id):
             logger.info(f"Leads insuficientes na base ({leads_processed}/{quantity}). Buscando {additional_needed} leads adicionais no Serper.")
             cnpj_cache = {}
             serper_cnpj_calls = 0
-            places = []
             processed_cnpjs_in_search = set()
 
             use_cache = False
@@ -198,48 +328,36 @@ def process_search_async(search_id):
                 logger.info("Usando cache do CachedSearch para buscar leads adicionais.")
 
             if use_cache:
-                cached_results = get_leads_from_cache(
+                cached_results, credits_debited = get_leads_from_cache(
                     cached_search, user_profile, additional_needed, search_obj,
                     extra_exclude_cnpjs=existing_cnpjs
                 )
+                credits_used += credits_debited
 
                 for company_data in cached_results:
                     cnpj = company_data.get('cnpj')
                     if cnpj:
-                        lead_access = LeadAccess.objects.filter(
-                            user=user_profile,
-                            lead__cnpj=cnpj,
-                            search=search_obj
-                        ).first()
-
-                        if lead_access and lead_access.credits_paid > 0:
-                            credits_used += 1
-
                         existing_cnpjs.add(cnpj)
 
                     leads_processed += 1
-                    results.append(company_data)
+                    results_summary.append({'name': company_data['name'], 'cnpj': company_data.get('cnpj')})
 
                     if leads_processed >= quantity:
                         break
 
                 num_from_cache = len(cached_results)
                 logger.info(f"Cache usado: {num_from_cache} leads adicionais do cache (total: {leads_processed}/{quantity})")
-                search_obj.results_count = SearchLead.objects.filter(search=search_obj).count()
-                search_obj.credits_used = credits_used
-                search_obj.save(update_fields=['results_count', 'credits_used'])
 
             if leads_processed < quantity:
                 processed_cnpjs_in_search = set()
-                for r in results:
+                for r in results_summary:
                     c = r.get('cnpj')
                     if c:
                         processed_cnpjs_in_search.add(c)
 
                 additional_needed = quantity - leads_processed
                 places = search_google_maps_paginated(search_term, additional_needed)
-                filtered_places, existing_cnpjs_set = filter_existing_leads(user_profile, places)
-                existing_cnpjs.update(existing_cnpjs_set)
+                filtered_places = places
 
                 results_per_page = 10
                 pages_searched = (len(places) + results_per_page - 1) // results_per_page if places else 0
@@ -251,10 +369,22 @@ def process_search_async(search_id):
                     'pages_searched': pages_searched,
                     'api_calls_made': api_calls_made,
                 })
-                search_obj.save(update_fields=['search_data'])
+                search_updates['search_data'] = search_obj.search_data
 
+                # Enriquecimento em paralelo: resolve CNPJ + dados públicos do lote de uma vez
+                cached_names = len(cnpj_cache)
+                enriched_places, existing_global = enrich_places(
+                    filtered_places, location=location, cnpj_cache=cnpj_cache,
+                    skip_cnpjs=processed_cnpjs_in_search | existing_cnpjs,
+                )
+                existing_cnpjs.update(existing_global)
+                serper_cnpj_calls += len(cnpj_cache) - cached_names
+
+                # Passo 1: seleção do lote em memória, sem I/O (dedup + cap)
+                batch = []
+                batch_cnpjs = set()
                 for place in filtered_places:
-                    if leads_processed >= quantity:
+                    if leads_processed + len(batch) >= quantity:
                         break
 
                     company_data = {
@@ -266,12 +396,7 @@ def process_search_async(search_id):
                     }
 
                     name_key = _normalize_company_name_for_cache(company_data['name'])
-                    if name_key in cnpj_cache:
-                        cnpj = cnpj_cache[name_key]
-                    else:
-                        cnpj = find_cnpj_by_name(company_data['name'], location=location)
-                        serper_cnpj_calls += 1
-                        cnpj_cache[name_key] = cnpj
+                    cnpj, public_data = enriched_places.get(name_key, (None, None))
 
                     if not cnpj:
                         logger.info(f"Lead '{company_data['name']}' não tem CNPJ, pulando e buscando mais leads...")
@@ -281,98 +406,140 @@ def process_search_async(search_id):
                         continue
                     if cnpj in existing_cnpjs:
                         continue
+                    if cnpj in batch_cnpjs:
+                        continue
 
                     company_data['cnpj'] = cnpj
-                    public_data = enrich_company_viper(cnpj)
                     if public_data:
                         company_data['viper_data'].update(public_data)
 
-                    existing_lead = Lead.objects.filter(cnpj=cnpj).first()
-
-                    if existing_lead:
-                        lead_obj = existing_lead
-                        if public_data:
-                            if not lead_obj.viper_data:
-                                lead_obj.viper_data = {}
-                            lead_obj.viper_data.update(public_data)
-                            lead_obj.save(update_fields=['viper_data'])
-                    else:
-                        lead_obj = Lead.objects.create(
-                            cached_search=cached_search,
-                            name=company_data['name'],
-                            address=company_data['address'],
-                            phone_maps=company_data['phone_maps'],
-                            cnpj=cnpj,
-                            viper_data=company_data['viper_data']
-                        )
-
-                    credits_paid_val = 0 if is_onboarding else 1
-                    lead_access, created = LeadAccess.objects.get_or_create(
-                        user=user_profile,
-                        lead=lead_obj,
-                        defaults={
-                            'search': search_obj,
-                            'credits_paid': credits_paid_val,
-                        }
+                    batch.append((company_data, cnpj, public_data))
+                    batch_cnpjs.add(cnpj)
+
+                if batch and not cached_search:
+                    cached_search = create_cached_search(niche_normalized, location_normalized, 0)
+                    search_obj.cached_search = cached_search
+                    search_updates['cached_search'] = cached_search
+
+                if batch:
+                    # Passo 2: resolver os Leads do lote em 3 queries
+                    # (lookup em lote + bulk_create + bulk_update) em vez de
+                    # filter().first() + create() por place
+                    # only(): o update/sanitização só toca nesses campos, não
+                    # vale carregar a linha inteira (viper_data já é multi-KB)
+                    existing_by_cnpj = _leads_by_cnpj(
+                        batch_cnpjs,
+                        ('id', 'cnpj', 'viper_data', 'viper_data_public', 'cached_search'),
+                    )
+                    to_create = []
+                    to_update = []
+                    for company_data, cnpj, public_data in batch:
+                        lead_obj = existing_by_cnpj.get(cnpj)
+                        if lead_obj:
+                            if public_data:
+                                if not lead_obj.viper_data:
+                                    lead_obj.viper_data = {}
+                                lead_obj.viper_data.update(public_data)
+                                lead_obj.viper_data_public = build_public_viper_data(lead_obj.viper_data)
+                            if lead_obj.cached_search_id != cached_search.id:
+                                lead_obj.cached_search = cached_search
+                                cache_leads_delta += 1
+                            to_update.append(lead_obj)
+                        else:
+                            to_create.append(Lead(
+                                cached_search=cached_search,
+                                name=company_data['name'],
+                                address=company_data['address'],
+                                phone_maps=company_data['phone_maps'],
+                                cnpj=cnpj,
+                                viper_data=company_data['viper_data'],
+                                viper_data_public=build_public_viper_data(company_data['viper_data'])
+                            ))
+
+                    if to_create:
+                        Lead.objects.bulk_create(to_create, ignore_conflicts=True, batch_size=100)
+                    if to_update:
+                        Lead.objects.bulk_update(to_update, ['viper_data', 'viper_data_public', 'cached_search'], batch_size=100)
+
+                    # Re-fetch para obter PKs dos recém-criados (ignore_conflicts
+                    # não preenche os ids); daqui em diante só id/cnpj são lidos
+                    leads_by_cnpj = _leads_by_cnpj(batch_cnpjs, ('id', 'cnpj'))
+                    cache_leads_delta += sum(
+                        1 for c in leads_by_cnpj if c not in existing_by_cnpj
                     )
 
-                    if created and not is_onboarding:
-                        success, new_balance, error = debit_credits(
-                            user_profile,
-                            1,
-                            description=f"Lead: {company_data['name']}"
+                    # Passo 3: acessos + débito do lote numa transação só.
+                    # Só lead_id/enriched_at interessam aqui, então um
+                    # values_list evita materializar instâncias de LeadAccess.
+                    lead_ids = [lead.id for lead in leads_by_cnpj.values()]
+                    enriched_map = dict(
+                        LeadAccess.objects.filter(
+                            user=user_profile, lead_id__in=lead_ids
+                        ).values_list('lead_id', 'enriched_at')
+                    )
+                    credits_paid_val = 0 if is_onboarding else 1
+                    new_accesses = [
+                        LeadAccess(
+                            user=user_profile,
+                            lead_id=lead.id,
+                            search=search_obj,
+                            credits_paid=credits_paid_val,
                         )
-                        if not success:
-                            logger.error(f"Débito de crédito falhou: {error}. Parando busca.")
-                            break
-                        credits_used += 1
-
-                    SearchLead.objects.get_or_create(search=search_obj, lead=lead_obj)
-                    sanitized_viper_data = sanitize_lead_data(
-                        {'viper_data': lead_obj.viper_data or {}},
-                        show_partners=(lead_access.enriched_at is not None)
-                    ).get('viper_data', {})
-                    company_data['viper_data'] = sanitized_viper_data
-                    leads_processed += 1
-                    processed_cnpjs_in_search.add(cnpj)
-                    results.append(company_data)
-
-                    if leads_processed % 5 == 0:
-                        search_obj.results_count = SearchLead.objects.filter(search=search_obj).count()
-                        search_obj.credits_used = credits_used
-                        search_obj.save(update_fields=['results_count', 'credits_used'])
-
-                    if not cached_search:
-                        cached_search = create_cached_search(niche_normalized, location_normalized, 0)
-                        search_obj.cached_search = cached_search
-                        search_obj.save(update_fields=['cached_search'])
-
-                    if lead_obj.cached_search != cached_search:
-                        lead_obj.cached_search = cached_search
-                        lead_obj.save(update_fields=['cached_search'])
+                        for lead in leads_by_cnpj.values()
+                        if lead.id not in enriched_map
+                    ]
+
+                    debit_failed = False
+                    with transaction.atomic():
+                        if new_accesses and not is_onboarding:
+                            success, new_balance, error = debit_credits(
+                                user_profile,
+                                len(new_accesses),
+                                description=f"{len(new_accesses)} lead(s) (busca Serper)"
+                            )
+                            if not success:
+                                logger.error(f"Débito de crédito falhou: {error}. Parando busca.")
+                                debit_failed = True
+                                new_accesses = []
+                            else:
+                                credits_used += len(new_accesses)
+
+                        if new_accesses:
+                            LeadAccess.objects.bulk_create(new_accesses, ignore_conflicts=True)
+                            for access in new_accesses:
+                                enriched_map[access.lead_id] = None
+
+                        delivered_ids = [
+                            lead.id for lead in leads_by_cnpj.values()
+                            if lead.id in enriched_map
+                        ]
+                        if delivered_ids:
+                            SearchLead.objects.bulk_create(
+                                [SearchLead(search=search_obj, lead_id=lead_id) for lead_id in delivered_ids],
+                                ignore_conflicts=True
+                            )
+
+                    for company_data, cnpj, public_data in batch:
+                        lead_obj = leads_by_cnpj.get(cnpj)
+                        if lead_obj is None:
+                            continue
+                        if lead_obj.id not in enriched_map:
+                            # Sem acesso (débito falhou): não entrega o lead
+                            continue
+                        leads_processed += 1
+                        processed_cnpjs_in_search.add(cnpj)
+                        results_summary.append({'name': company_data['name'], 'cnpj': company_data.get('cnpj')})
 
                 if serper_cnpj_calls or pages_searched:
                     logger.info(f"Serper: {pages_searched} páginas + {serper_cnpj_calls} find_cnpj (cache: {len(cnpj_cache)} nomes)")
 
-            if cached_search:
-                total_leads = Lead.objects.filter(
-                    cached_search=cached_search,
-                    cnpj__isnull=False
-                ).exclude(cnpj='').values('cnpj').distinct().count()
-
-                if cached_search.total_leads_cached != total_leads:
-                    cached_search.total_leads_cached = total_leads
-                    cached_search.save(update_fields=['total_leads_cached', 'last_updated'])
-
-        if cached_search and niche_normalized and location_normalized:
-            total_leads = Lead.objects.filter(
-                cached_search=cached_search,
-                cnpj__isnull=False
-            ).exclude(cnpj='').values('cnpj').distinct().count()
-
-            if cached_search.total_leads_cached != total_leads:
-                cached_search.total_leads_cached = total_leads
-                cached_search.save(update_fields=['total_leads_cached', 'last_updated'])
+        if cached_search and cache_leads_delta:
+            # Contador mantido incrementalmente: evita o COUNT(DISTINCT cnpj)
+            # sobre a partição inteira do cache a cada busca
+            CachedSearch.objects.filter(pk=cached_search.pk).update(
+                total_leads_cached=F('total_leads_cached') + cache_leads_delta,
+                last_updated=timezone.now(),
+            )
 
         if leads_processed < quantity:
             additional_needed = quantity - leads_processed
@@ -393,16 +560,25 @@ def process_search_async(search_id):
                     logger.warning(f"Limite de requisições à API atingido ({max_api_requests}). Parando busca incremental.")
                     break
 
+                # Janela de páginas buscada em paralelo (I/O-bound): colapsa
+                # as 5 chamadas sequenciais em ~1 RTT, ao custo de buscar
+                # especulativamente páginas após uma vazia (descartadas abaixo)
                 pages_per_iteration = 5
-                incremental_places_batch = []
-                for i in range(pages_per_iteration):
-                    if leads_processed >= quantity or api_requests_made >= max_api_requests:
-                        break
-                    page_num = start_page + incremental_iteration * pages_per_iteration + i
-                    logger.info(f"Busca incremental (iteração {incremental_iteration + 1}, page: {page_num})...")
-                    places_page = search_google_hybrid(search_term, num=results_per_page, page=page_num)
-                    api_requests_made += 1
+                first_page = start_page + incremental_iteration * pages_per_iteration
+                pages_to_fetch = range(
+                    first_page,
+                    first_page + min(pages_per_iteration, max_api_requests - api_requests_made),
+                )
+                logger.info(f"Busca incremental (iteração {incremental_iteration + 1}, pages: {pages_to_fetch.start}-{pages_to_fetch.stop - 1})...")
+                with ThreadPoolExecutor(max_workers=len(pages_to_fetch)) as executor:
+                    pages = list(executor.map(
+                        lambda page_num: search_google_hybrid(search_term, num=results_per_page, page=page_num),
+                        pages_to_fetch,
+                    ))
+                api_requests_made += len(pages_to_fetch)
 
+                incremental_places_batch = []
+                for page_num, places_page in zip(pages_to_fetch, pages):
                     if not places_page:
                         logger.info(f"Não há mais resultados na página {page_num}.")
                         break
@@ -419,14 +595,25 @@ def process_search_async(search_id):
                     incremental_iteration += 1
                     continue
 
-                incremental_filtered, _ = filter_existing_leads(user_profile, incremental_places_batch)
+                incremental_filtered = incremental_places_batch
+
+                # Mesmo enriquecimento paralelo do lote principal, por batch incremental
+                cached_names = len(cnpj_cache)
+                enriched_batch, existing_global = enrich_places(
+                    incremental_filtered, location=location, cnpj_cache=cnpj_cache,
+                    skip_cnpjs=processed_cnpjs_in_search | existing_cnpjs,
+                )
+                existing_cnpjs.update(existing_global)
+                serper_cnpj_calls += len(cnpj_cache) - cached_names
 
-                leads_found_in_batch = 0
                 leads_without_cnpj = 0
                 leads_duplicated = 0
 
+                # Passo 1: seleção do lote em memória, sem I/O (dedup + cap)
+                inc_batch = []
+                inc_batch_cnpjs = set()
                 for place in incremental_filtered:
-                    if leads_processed >= quantity:
+                    if leads_processed + len(inc_batch) >= quantity:
                         break
 
                     company_data = {
@@ -438,83 +625,120 @@ def process_search_async(search_id):
                     }
 
                     name_key = _normalize_company_name_for_cache(company_data['name'])
-                    if name_key in cnpj_cache:
-                        cnpj = cnpj_cache[name_key]
-                    else:
-                        cnpj = find_cnpj_by_name(company_data['name'], location=location)
-                        serper_cnpj_calls += 1
-                        cnpj_cache[name_key] = cnpj
+                    cnpj, public_data = enriched_batch.get(name_key, (None, None))
 
                     if not cnpj:
                         leads_without_cnpj += 1
                         continue
-                    if cnpj in processed_cnpjs_in_search:
-                        leads_duplicated += 1
-                        continue
-                    if cnpj in existing_cnpjs:
+                    if cnpj in processed_cnpjs_in_search or cnpj in existing_cnpjs or cnpj in inc_batch_cnpjs:
                         leads_duplicated += 1
                         continue
 
                     company_data['cnpj'] = cnpj
-                    public_data = enrich_company_viper(cnpj)
                     if public_data:
                         company_data['viper_data'].update(public_data)
 
-                    existing_lead = Lead.objects.filter(cnpj=cnpj).first()
-
-                    if existing_lead:
-                        lead_obj = existing_lead
-                        if public_data:
-                            if not lead_obj.viper_data:
-                                lead_obj.viper_data = {}
-                            lead_obj.viper_data.update(public_data)
-                            lead_obj.save(update_fields=['viper_data'])
-                    else:
-                        lead_obj = Lead.objects.create(
-                            name=company_data['name'],
-                            address=company_data['address'],
-                            phone_maps=company_data['phone_maps'],
-                            cnpj=cnpj,
-                            viper_data=company_data['viper_data']
-                        )
+                    inc_batch.append((company_data, cnpj, public_data))
+                    inc_batch_cnpjs.add(cnpj)
 
-                    credits_paid_val = 0 if is_onboarding else 1
-                    lead_access, created = LeadAccess.objects.get_or_create(
-                        user=user_profile,
-                        lead=lead_obj,
-                        defaults={
-                            'search': search_obj,
-                            'credits_paid': credits_paid_val,
-                        }
+                leads_found_in_batch = 0
+                debit_failed = False
+                if inc_batch:
+                    # Passo 2: resolver os Leads do lote em lote (lookup +
+                    # bulk_create + bulk_update), como no ramo principal
+                    existing_by_cnpj = _leads_by_cnpj(
+                        inc_batch_cnpjs,
+                        ('id', 'cnpj', 'viper_data', 'viper_data_public'),
                     )
-
-                    if created and not is_onboarding:
-                        success, new_balance, error = debit_credits(
-                            user_profile,
-                            1,
-                            description=f"Lead: {company_data['name']}"
+                    to_create = []
+                    to_update = []
+                    for company_data, cnpj, public_data in inc_batch:
+                        lead_obj = existing_by_cnpj.get(cnpj)
+                        if lead_obj:
+                            if public_data:
+                                if not lead_obj.viper_data:
+                                    lead_obj.viper_data = {}
+                                lead_obj.viper_data.update(public_data)
+                                lead_obj.viper_data_public = build_public_viper_data(lead_obj.viper_data)
+                                to_update.append(lead_obj)
+                        else:
+                            to_create.append(Lead(
+                                name=company_data['name'],
+                                address=company_data['address'],
+                                phone_maps=company_data['phone_maps'],
+                                cnpj=cnpj,
+                                viper_data=company_data['viper_data'],
+                                viper_data_public=build_public_viper_data(company_data['viper_data'])
+                            ))
+
+                    if to_create:
+                        Lead.objects.bulk_create(to_create, ignore_conflicts=True, batch_size=100)
+                    if to_update:
+                        Lead.objects.bulk_update(to_update, ['viper_data', 'viper_data_public'], batch_size=100)
+
+                    leads_by_cnpj = _leads_by_cnpj(inc_batch_cnpjs, ('id', 'cnpj'))
+
+                    # Passo 3: acessos + débito do lote numa transação só
+                    lead_ids = [lead.id for lead in leads_by_cnpj.values()]
+                    enriched_map = dict(
+                        LeadAccess.objects.filter(
+                            user=user_profile, lead_id__in=lead_ids
+                        ).values_list('lead_id', 'enriched_at')
+                    )
+                    credits_paid_val = 0 if is_onboarding else 1
+                    new_accesses = [
+                        LeadAccess(
+                            user=user_profile,
+                            lead_id=lead.id,
+                            search=search_obj,
+                            credits_paid=credits_paid_val,
                         )
-                        if not success:
-                            logger.error(f"Débito de crédito falhou: {error}. Parando busca incremental.")
-                            break
-                        credits_used += 1
-
-                    SearchLead.objects.get_or_create(search=search_obj, lead=lead_obj)
-                    sanitized_viper_data = sanitize_lead_data(
-                        {'viper_data': lead_obj.viper_data or {}},
-                        show_partners=(lead_access.enriched_at is not None)
-                    ).get('viper_data', {})
-                    company_data['viper_data'] = sanitized_viper_data
-                    leads_processed += 1
-                    processed_cnpjs_in_search.add(cnpj)
-                    existing_cnpjs.add(cnpj)
-                    leads_found_in_batch += 1
-                    results.append(company_data)
+                        for lead in leads_by_cnpj.values()
+                        if lead.id not in enriched_map
+                    ]
+
+                    with transaction.atomic():
+                        if new_accesses and not is_onboarding:
+                            success, new_balance, error = debit_credits(
+                                user_profile,
+                                len(new_accesses),
+                                description=f"{len(new_accesses)} lead(s) (busca incremental)"
+                            )
+                            if not success:
+                                logger.error(f"Débito de crédito falhou: {error}. Parando busca incremental.")
+                                debit_failed = True
+                                new_accesses = []
+                            else:
+                                credits_used += len(new_accesses)
+
+                        if new_accesses:
+                            LeadAccess.objects.bulk_create(new_accesses, ignore_conflicts=True)
+                            for access in new_accesses:
+                                enriched_map[access.lead_id] = None
+
+                        delivered_ids = [
+                            lead.id for lead in leads_by_cnpj.values()
+                            if lead.id in enriched_map
+                        ]
+                        if delivered_ids:
+                            SearchLead.objects.bulk_create(
+                                [SearchLead(search=search_obj, lead_id=lead_id) for lead_id in delivered_ids],
+                                ignore_conflicts=True
+                            )
+
+                    for company_data, cnpj, public_data in inc_batch:
+                        lead_obj = leads_by_cnpj.get(cnpj)
+                        if lead_obj is None or lead_obj.id not in enriched_map:
+                            # Sem acesso (débito falhou): não entrega o lead
+                            continue
+                        leads_processed += 1
+                        processed_cnpjs_in_search.add(cnpj)
+                        existing_cnpjs.add(cnpj)
+                        leads_found_in_batch += 1
+                        results_summary.append({'name': company_data['name'], 'cnpj': company_data.get('cnpj')})
 
-                    if leads_processed % 5 == 0:
-                        search_obj.results_count = SearchLead.objects.filter(search=search_obj).count()
-                        search_obj.credits_used = credits_used
-                        search_obj.save(update_fields=['results_count', 'credits_used'])
+                if debit_failed:
+                    break
 
                 if leads_found_in_batch > 0:
                     consecutive_empty_iterations = 0
@@ -570,19 +794,12 @@ def process_search_async(search_id):
                 lead_obj.save(update_fields=['viper_data'])
                 logger.info(f"Onboarding: QSA completo (com telefones dos sócios) salvo no lead {lead_obj.id} (CNPJ {lead_obj.cnpj})")
 
-        search_obj.results_count = SearchLead.objects.filter(search=search_obj).count()
-        search_obj.credits_used = credits_used
-        search_obj.results_data = {
-            'leads': [
-                {
-                    'name': r['name'],
-                    'cnpj': r.get('cnpj'),
-                }
-                for r in results
-            ]
-        }
-        search_obj.status = 'completed'
-        search_obj.save(update_fields=['results_count', 'credits_used', 'results_data', 'status'])
+        # UPDATE terminal único com tudo que foi acumulado na busca
+        search_updates['results_count'] = SearchLead.objects.filter(search=search_obj).count()
+        search_updates['credits_used'] = credits_used
+        search_updates['results_data'] = {'leads': results_summary}
+        search_updates['status'] = 'completed'
+        Search.objects.filter(pk=search_id).update(**search_updates)
 
         logger.info(f"Busca {search_id} concluída: {leads_processed} leads processados, {credits_used} créditos debitados")
 
@@ -1,15 +1,73 @@
+import functools
 import json
 import logging
 import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain, islice
+from operator import itemgetter
+
 import requests
 from decouple import config
 
+from lead_extractor.services.normalization import remove_accents
+
 logger = logging.getLogger(__name__)
 
 SERPER_API_KEY = config('SERPER_API_KEY', default='')
 SERPER_GL = config('SERPER_GL', default='br')
 SERPER_HL = config('SERPER_HL', default='pt-br')
 
+# Sessão compartilhada com pool de conexões keep-alive: a busca paginada faz
+# 10-20 chamadas seguidas ao Serper e refazer TCP + TLS a cada uma custa caro.
+# Headers são idênticos em todas as chamadas, então ficam na sessão.
+_serper_session = requests.Session()
+_serper_session.mount(
+    'https://',
+    requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=16),
+)
+_serper_session.headers.update({
+    'X-API-KEY': SERPER_API_KEY,
+    'Content-Type': 'application/json',
+})
+
+# Backpressure global: várias buscas rodando em threads podem disparar
+# janelas de páginas em paralelo ao mesmo tempo; o semáforo limita as
+# requisições simultâneas ao Serper no processo (as demais bloqueiam na
+# fila em vez de estourar o rate limit da API).
+_SERPER_MAX_INFLIGHT = 12
+_serper_semaphore = threading.BoundedSemaphore(_SERPER_MAX_INFLIGHT)
+
+
+def _serper_post(url, data):
+    """POST ao Serper respeitando o teto global de requisições em voo."""
+    with _serper_semaphore:
+        return _serper_session.post(url, data=data)
+
+
+_NON_DIGIT_RE = re.compile(r'\D')
+
+# CNPJ com ou sem máscara (ex.: 12.345.678/0001-90); pré-compilada porque
+# find_cnpj_by_name varre vários snippets por chamada
+_CNPJ_RE = re.compile(r'\d{2}\.?\d{3}\.?\d{3}/?\d{4}-?\d{2}')
+
+
+def _place_dedup_key(place):
+    """
+    Chave de deduplicação de um place: (título normalizado, telefone só dígitos).
+
+    A normalização do título é propositalmente SEM cache: títulos são
+    quase todos distintos e passariam pelo LRU de normalize_niche evictando
+    o vocabulário pequeno de nichos que ele existe para memoizar.
+
+    Limitação conhecida: dois estabelecimentos homônimos sem phoneNumber
+    colapsam numa chave só e viram um único place.
+    """
+    return (
+        remove_accents(_normalize_company_name_for_cache(place.get('title', ''))).lower(),
+        _NON_DIGIT_RE.sub('', place.get('phoneNumber') or ''),
+    )
+
 def _normalize_company_name_for_cache(name):
     """Normaliza nome para cache (strip, collapse espaços). Evita duplicatas por variações mínimas."""
     if not name or not isinstance(name, str):
@@ -89,12 +147,8 @@ def search_google_maps(query, num=10, page=1):
         "num": num,
         "page": page
     }
-    headers = {
-        'X-API-KEY': SERPER_API_KEY,
-        'Content-Type': 'application/json'
-    }
     try:
-        response = requests.post(url, headers=headers, data=json.dumps(payload))
+        response = _serper_post(url, data=json.dumps(payload))
         response.raise_for_status()
         response_data = response.json()
         return normalize_places_response(response_data, source='places')
@@ -131,13 +185,8 @@ def search_google_hybrid(query, num=10, page=1, min_results=None):
         "num": num,
         "page": page
     }
-    headers = {
-        'X-API-KEY': SERPER_API_KEY,
-        'Content-Type': 'application/json'
-    }
-    
     try:
-        response = requests.post(url_search, headers=headers, data=json.dumps(payload))
+        response = _serper_post(url_search, data=json.dumps(payload))
         response.raise_for_status()
         search_data = response.json()
         places_from_search = normalize_places_response(search_data, source='search')
@@ -145,17 +194,19 @@ def search_google_hybrid(query, num=10, page=1, min_results=None):
         if places_from_search and len(places_from_search) >= min_results:
             logger.info(f"Usando resultados de /search (places: {len(places_from_search)}, suficiente)")
             return places_from_search
+        elif len(places_from_search) >= min_results * 0.8:
+            # Cobertura >= 80% do esperado: o complemento via /places quase só
+            # traria duplicatas; não vale a round-trip extra ao Serper
+            logger.info(f"Usando só /search (places: {len(places_from_search)}, >= 80% de {min_results})")
+            return places_from_search
         elif places_from_search:
             logger.info(f"Usando /places como complemento (search retornou {len(places_from_search)}, esperado: {min_results})")
             places_from_places = search_google_maps(query, num=num, page=page)
-            combined = places_from_search.copy()
-            existing_titles = {p.get('title') for p in places_from_search}
-            for place in places_from_places:
-                if place.get('title') not in existing_titles:
-                    combined.append(place)
-                    if len(combined) >= min_results:
-                        break
-            return combined[:min_results]
+            # Merge em uma passada: /search primeiro, depois os extras de /places
+            # que não colidem por título, truncado em min_results (uma alocação só)
+            existing_titles = set(map(itemgetter('title'), places_from_search))
+            extras = (p for p in places_from_places if p.get('title') not in existing_titles)
+            return list(islice(chain(places_from_search, extras), min_results))
         else:
             logger.info("Usando /places como fallback (search não retornou places)")
             return search_google_maps(query, num=num, page=page)
@@ -168,57 +219,80 @@ def search_google_hybrid(query, num=10, page=1, min_results=None):
         return search_google_maps(query, num=num, page=page)
 
 
+# Quantas páginas do Serper buscar em paralelo por janela na busca paginada
+_PAGE_FETCH_WORKERS = 4
+
+
 def search_google_maps_paginated(query, max_results, max_pages=20):
     """
     Busca empresas no Google Maps via Serper com paginação automática.
     Usa page (1-based). gl/hl para Brasil.
-    
+
+    As páginas são buscadas em janelas paralelas de até _PAGE_FETCH_WORKERS
+    (o trabalho é I/O-bound), mas processadas em ordem de página para manter
+    a deduplicação e as condições de parada idênticas à versão sequencial.
+
     Args:
         query: Termo de busca (ex: "Advogado em São Paulo - SP")
         max_results: Quantidade máxima de resultados desejada
         max_pages: Limite máximo de páginas para evitar consumo excessivo (padrão: 20)
-    
+
     Returns:
         list: Lista completa de lugares encontrados (pode ser menor que max_results se não houver mais resultados)
     """
     all_places = []
-    page_num = 1  # Serper usa page 1-based
+    seen = set()  # Dedup entre páginas: a mesma empresa pode aparecer em páginas adjacentes
     results_per_page = 10
     max_results_safe = min(max_results, 200)
-    
+    next_page = 1  # Serper usa page 1-based
+    stop = False
+
     logger.info(f"Iniciando busca paginada para '{query}': até {max_results_safe} resultados (máx. {max_pages} páginas)")
-    
-    while len(all_places) < max_results_safe and page_num <= max_pages:
+
+    while not stop and len(all_places) < max_results_safe and next_page <= max_pages:
+        # Janela limitada ao que ainda falta: não paga páginas que serão descartadas
+        remaining_needed = max_results_safe - len(all_places)
+        pages_needed = -(-remaining_needed // results_per_page)
+        window_size = min(_PAGE_FETCH_WORKERS, pages_needed, max_pages - next_page + 1)
+        window = range(next_page, next_page + window_size)
+        next_page += window_size
+
         try:
-            remaining_needed = max_results_safe - len(all_places)
-            logger.info(f"Buscando página {page_num} para '{query}' (page: {page_num})...")
-            places = search_google_hybrid(
-                query, num=results_per_page, page=page_num,
-                min_results=min(remaining_needed, results_per_page)
-            )
-            
+            logger.info(f"Buscando páginas {window.start}-{window.stop - 1} para '{query}' em paralelo...")
+            with ThreadPoolExecutor(max_workers=window_size) as executor:
+                pages = list(executor.map(
+                    lambda p: search_google_hybrid(query, num=results_per_page, page=p, min_results=results_per_page),
+                    window,
+                ))
+        except Exception as e:
+            logger.error(f"Erro ao buscar páginas {window.start}-{window.stop - 1} para '{query}': {e}. Usando resultados já obtidos.", exc_info=True)
+            break
+
+        for page_num, places in zip(window, pages):
             if not places:
                 logger.info(f"Página {page_num} retornou 0 resultados. Sem mais resultados.")
+                stop = True
                 break
-            
-            all_places.extend(places)
+
+            for place in places:
+                key = _place_dedup_key(place)
+                if key in seen:
+                    continue
+                seen.add(key)
+                all_places.append(place)
             logger.info(f"Página {page_num} retornou {len(places)} resultados. Total: {len(all_places)}")
-            
+
             if len(all_places) >= max_results_safe:
                 logger.info(f"Quantidade atingida: {len(all_places)} (solicitado: {max_results_safe}).")
+                stop = True
                 break
-            
+
             if len(places) < results_per_page:
                 logger.info(f"Página {page_num} retornou < {results_per_page} resultados. Fim dos resultados.")
+                stop = True
                 break
-            
-            page_num += 1
-                
-        except Exception as e:
-            logger.error(f"Erro ao buscar página {page_num} para '{query}': {e}. Usando resultados já obtidos.", exc_info=True)
-            break
-    
-    logger.info(f"Busca paginada concluída para '{query}': {len(all_places)} resultados em {page_num} página(s)")
+
+    logger.info(f"Busca paginada concluída para '{query}': {len(all_places)} resultados em {next_page - 1} página(s)")
     return all_places[:max_results_safe]
 
 def find_cnpj_by_name(company_name, location=None):
@@ -226,35 +300,48 @@ def find_cnpj_by_name(company_name, location=None):
     Busca 'CNPJ [Nome]' no Google via Serper e extrai via Regex.
     Se location for informado, inclui na query para desambiguar (evitar CNPJ de outra cidade).
     Usa gl/hl para Brasil. Sem page (só primeira página).
+
+    Memoizada por processo (nome normalizado + localização): o mesmo
+    estabelecimento reaparece em buscas concorrentes e repetir a chamada
+    ao Serper custa um round-trip HTTPS e quota.
+
+    Erros de rede são tratados aqui, fora do helper memoizado: lru_cache
+    não guarda chamadas que levantam exceção, então uma falha transitória
+    não fixa "sem CNPJ" para o estabelecimento pelo resto do processo. O
+    None de uma busca que respondeu mas não trouxe CNPJ é um negativo
+    legítimo e continua cacheado.
     """
     name = _normalize_company_name_for_cache(company_name)
     if not name:
         return None
+    location_key = str(location).strip() if location and str(location).strip() else ''
+    try:
+        return _find_cnpj_cached(name, location_key)
+    except requests.RequestException as e:
+        logger.error(f"Erro ao buscar CNPJ no Google via Serper: {e}", exc_info=True)
+    except Exception as e:
+        logger.error(f"Erro inesperado ao buscar CNPJ: {e}", exc_info=True)
+    return None
+
+
+@functools.lru_cache(maxsize=10000)
+def _find_cnpj_cached(name, location_key):
     query = f"CNPJ {name}"
-    if location and str(location).strip():
-        query = f"{query} {str(location).strip()}"
+    if location_key:
+        query = f"{query} {location_key}"
     url = "https://google.serper.dev/search"
     payload = json.dumps({
         "q": query,
         "gl": SERPER_GL,
         "hl": SERPER_HL
     })
-    headers = {
-        'X-API-KEY': SERPER_API_KEY,
-        'Content-Type': 'application/json'
-    }
-    
-    try:
-        response = requests.post(url, headers=headers, data=payload)
-        data = response.json()
-        if 'organic' in data:
-            for result in data['organic']:
-                snippet = result.get('snippet', '') + " " + result.get('title', '')
-                cnpj_match = re.search(r'\d{2}\.?\d{3}\.?\d{3}/?\d{4}-?\d{2}', snippet)
-                if cnpj_match:
-                    return re.sub(r'\D', '', cnpj_match.group())
-    except requests.RequestException as e:
-        logger.error(f"Erro ao buscar CNPJ no Google via Serper: {e}", exc_info=True)
-    except Exception as e:
-        logger.error(f"Erro inesperado ao buscar CNPJ: {e}", exc_info=True)
+    response = _serper_post(url, data=payload)
+    response.raise_for_status()
+    data = response.json()
+    if 'organic' in data:
+        for result in data['organic']:
+            snippet = result.get('snippet', '') + " " + result.get('title', '')
+            cnpj_match = _CNPJ_RE.search(snippet)
+            if cnpj_match:
+                return _NON_DIGIT_RE.sub('', cnpj_match.group())
     return None
\ No newline at end of file
@@ -1,7 +1,9 @@
-import json
+import functools
 import logging
 import re
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
 import requests
 from decouple import config
 
@@ -13,6 +15,17 @@ logger = logging.getLogger(__name__)
 
 VIPER_API_KEY = config('VIPER_API_KEY', default='')
 
+_NON_DIGIT_RE = re.compile(r'\D')
+
+# Sessão compartilhada com keep-alive (mesmo padrão do serper_service): o
+# enriquecimento em lote dispara dezenas de chamadas seguidas aos dois hosts
+# do Viper e refazer TCP + TLS por chamada custa ~150ms cada.
+_viper_session = requests.Session()
+_viper_session.mount(
+    'https://',
+    requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=16),
+)
+
 # Campos de contato que devem ser removidos dos socios (nunca expor sem CPF enrichment pago)
 SOCIOS_CONTACT_KEYS_TO_STRIP = {
     'telefones', 'emails', 'TELEFONE', 'telefones_fixos', 'telefones_moveis',
@@ -28,7 +41,36 @@ SOCIOS_ALLOWED_KEYS = {
 
 
 def enrich_company_viper(cnpj):
-    """Consulta dados detalhados no Viper (API PÚBLICA) pelo CNPJ"""
+    """
+    Consulta dados detalhados no Viper (API PÚBLICA) pelo CNPJ.
+
+    Memoizada por processo: o mesmo CNPJ reaparece entre buscas e os dados
+    públicos mudam raramente. Retorna uma cópia rasa para os chamadores não
+    mutarem a entrada do cache.
+
+    Erros transitórios (timeout, 5xx, queda de rede) são tratados AQUI, fora
+    do helper memoizado: como lru_cache não guarda chamadas que levantam
+    exceção, uma instabilidade momentânea não fixa None para o CNPJ pelo
+    resto da vida do processo.
+    """
+    try:
+        data = _enrich_company_cached(cnpj)
+    except requests.RequestException as e:
+        logger.error(f"Erro ao buscar dados da empresa no Viper (CNPJ: {cnpj}): {e}", exc_info=True)
+        return None
+    except Exception as e:
+        logger.error(f"Erro inesperado ao buscar dados da empresa no Viper: {e}", exc_info=True)
+        return None
+    return dict(data) if data is not None else None
+
+
+@functools.lru_cache(maxsize=4096)
+def _enrich_company_cached(cnpj):
+    """
+    Só resultados definitivos entram no cache: payload do 200 ou None de
+    respostas não-200 "estáveis" (ex.: CNPJ inexistente). Falhas de rede
+    propagam a exceção para o wrapper e ficam fora do cache.
+    """
     if not VIPER_API_KEY:
         return None
 
@@ -36,85 +78,117 @@ def enrich_company_viper(cnpj):
     headers = {
         'Authorization': f'Basic {VIPER_API_KEY}'
     }
-    
-    try:
-        response = requests.get(url, headers=headers)
-        if response.status_code == 200:
-            return response.json()
-    except requests.RequestException as e:
-        logger.error(f"Erro ao buscar dados da empresa no Viper (CNPJ: {cnpj}): {e}", exc_info=True)
-    except Exception as e:
-        logger.error(f"Erro inesperado ao buscar dados da empresa no Viper: {e}", exc_info=True)
-    
+
+    response = _viper_session.get(url, headers=headers)
+    if response.status_code == 200:
+        return response.json()
+    if response.status_code >= 500:
+        # Erro do lado do servidor é transitório — não memoizar como "sem dados"
+        response.raise_for_status()
     return None
 
+def enrich_companies_viper(cnpjs, max_workers=8):
+    """
+    Enriquece um lote de CNPJs na API pública do Viper.
+
+    A API não expõe endpoint de lote, então as consultas individuais são
+    disparadas em paralelo (I/O-bound) para amortizar o round-trip por CNPJ.
+
+    Args:
+        cnpjs: Iterable de CNPJs (apenas números)
+        max_workers: Número máximo de threads
+
+    Returns:
+        dict: cnpj -> dados do Viper (CNPJs sem resposta ficam fora do dict)
+    """
+    results = {}
+    unique_cnpjs = [c for c in dict.fromkeys(cnpjs) if c]
+    if not unique_cnpjs or not VIPER_API_KEY:
+        return results
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(unique_cnpjs))) as executor:
+        futures = {executor.submit(enrich_company_viper, cnpj): cnpj for cnpj in unique_cnpjs}
+        for future in as_completed(futures):
+            data = future.result()
+            if data:
+                results[futures[future]] = data
+
+    return results
+
+
 def get_partners_internal(cnpj, retry=True):
     """
     Busca o QSA (Quadro de Sócios e Administradores) na API interna do Viper.
-    
+
     Fluxo:
     1. Tenta ler tokens do arquivo
     2. Se não tem tokens e retry=True, executa auth_bot
     3. Faz requisição à API
-    4. Se receber 401 e retry=True, renova tokens e tenta novamente
-    
+    4. Se receber 401 e retry=True, renova tokens e tenta novamente (uma única vez)
+
+    O retry é feito de forma iterativa (loop de 2 tentativas) em vez de recursão,
+    evitando frame extra na pilha e releitura desnecessária de tokens.
+
     Args:
         cnpj: CNPJ da empresa (apenas números)
         retry: Se True, tenta renovar tokens automaticamente em caso de erro
-        
+
     Returns:
         list: Lista de sócios ou lista vazia em caso de erro
     """
-    auth_headers = get_auth_headers()
-    
-    # Se não tem headers, tenta gerar agora
-    if not auth_headers and retry:
-        logger.info("Nenhum token encontrado. Executando auth_bot...")
-        if run_auth_bot():
-            auth_headers = get_auth_headers()
-        else:
-            logger.error("Falha ao executar auth_bot")
-
-    if not auth_headers:
-        logger.warning("Sem tokens de autenticação disponíveis")
-        return []
-
     url = "https://sistemas.vipersolucoes.com.br/server/api/infoqualy/consultaCNPJSocios"
-    
-    headers = auth_headers.copy()
-    headers.update({
-        'content-type': 'application/json',
-        'origin': 'https://sistemas.vipersolucoes.com.br',
-        'referer': 'https://sistemas.vipersolucoes.com.br/',
-    })
-    
     payload = {"CNPJ": str(cnpj).strip()}
-    
-    try:
-        response = requests.post(url, headers=headers, json=payload, timeout=30)
-        
-        if response.status_code == 200:
-            return response.json()
-            
-        elif response.status_code == 401 and retry:
-            logger.warning(f"Token do Viper expirado (401). Renovando tokens... (CNPJ: {cnpj})")
+    max_attempts = 2 if retry else 1
+
+    for attempt in range(max_attempts):
+        auth_headers = get_auth_headers()
+
+        # Se não tem headers, tenta gerar agora (apenas na primeira tentativa)
+        if not auth_headers and retry and attempt == 0:
+            logger.info("Nenhum token encontrado. Executando auth_bot...")
             if run_auth_bot():
-                # Chama a função de novo (recursiva), mas sem retry infinito
-                return get_partners_internal(cnpj, retry=False)
+                auth_headers = get_auth_headers()
             else:
+                logger.error("Falha ao executar auth_bot")
+
+        if not auth_headers:
+            logger.warning("Sem tokens de autenticação disponíveis")
+            return []
+
+        # Merge em uma alocação só (em vez de copy() + update())
+        headers = {
+            **auth_headers,
+            'content-type': 'application/json',
+            'origin': 'https://sistemas.vipersolucoes.com.br',
+            'referer': 'https://sistemas.vipersolucoes.com.br/',
+        }
+
+        try:
+            response = _viper_session.post(url, headers=headers, json=payload, timeout=30)
+
+            if response.status_code == 200:
+                return response.json()
+
+            elif response.status_code == 401 and attempt + 1 < max_attempts:
+                logger.warning(f"Token do Viper expirado (401). Renovando tokens... (CNPJ: {cnpj})")
+                if run_auth_bot():
+                    # Próxima iteração relê os tokens renovados
+                    continue
                 logger.error("Falha ao renovar tokens após 401")
                 return []
-            
-        else:
-            logger.error(f"Erro ao buscar sócios no Viper (CNPJ: {cnpj}): Status {response.status_code} - {response.text}")
-            
-    except requests.Timeout:
-        logger.error(f"Timeout ao buscar sócios no Viper (CNPJ: {cnpj})")
-    except requests.RequestException as e:
-        logger.error(f"Erro de rede ao buscar sócios no Viper (CNPJ: {cnpj}): {e}", exc_info=True)
-    except Exception as e:
-        logger.error(f"Erro inesperado ao buscar sócios no Viper: {e}", exc_info=True)
-        
+
+            else:
+                logger.error(f"Erro ao buscar sócios no Viper (CNPJ: {cnpj}): Status {response.status_code} - {response.text}")
+
+        except requests.Timeout:
+            logger.error(f"Timeout ao buscar sócios no Viper (CNPJ: {cnpj})")
+        except requests.RequestException as e:
+            logger.error(f"Erro de rede ao buscar sócios no Viper (CNPJ: {cnpj}): {e}", exc_info=True)
+        except Exception as e:
+            logger.error(f"Erro inesperado ao buscar sócios no Viper: {e}", exc_info=True)
+
+        return []
+
     return []
 
 def get_partners_internal_queued(cnpj, user_profile, lead=None):
@@ -153,34 +227,42 @@ def get_partners_internal_queued(cnpj, user_profile, lead=None):
         'is_new': is_new
     }
 
-def wait_for_partners_processing(queue_id, user_profile, timeout=60, poll_interval=1):
+def wait_for_partners_processing(queue_id, user_profile, timeout=60, poll_interval=None):
     """
     Aguarda o processamento de uma requisição de sócios na fila.
-    
+
+    O poll usa backoff exponencial (50ms dobrando até 2s): a maioria das
+    requisições completa em menos de 1s, então os primeiros polls curtos as
+    capturam quase na hora, enquanto esperas longas não martelam o banco.
+
     Args:
         queue_id: ID da requisição na fila
         user_profile: UserProfile do usuário (para validação)
         timeout: Tempo máximo de espera em segundos (default: 60)
-        poll_interval: Intervalo entre verificações em segundos (default: 1)
-    
+        poll_interval: Intervalo fixo entre verificações em segundos
+            (default: None = backoff exponencial)
+
     Returns:
         dict ou None: Resultado da requisição se completada, None se falhou ou timeout
     """
     start_time = time.time()
-    
+    interval = poll_interval if poll_interval is not None else 0.05
+
     while time.time() - start_time < timeout:
         try:
             queue_item = ViperRequestQueue.objects.get(id=queue_id, user=user_profile)
-            
+
             if queue_item.status == 'completed':
                 return queue_item.result_data
             elif queue_item.status == 'failed':
                 logger.warning(f"Requisição {queue_id} falhou: {queue_item.error_message}")
                 return None
-            
+
             # Aguardar antes de verificar novamente
-            time.sleep(poll_interval)
-            
+            time.sleep(interval)
+            if poll_interval is None:
+                interval = min(interval * 2, 2.0)
+
         except ViperRequestQueue.DoesNotExist:
             logger.error(f"Requisição {queue_id} não encontrada")
             return None
@@ -205,7 +287,7 @@ def search_cpf_viper(cpf):
         return None
     
     # Limpar CPF (remover pontos, traços, etc)
-    cpf_clean = re.sub(r'\D', '', str(cpf))
+    cpf_clean = _NON_DIGIT_RE.sub('', str(cpf))
     
     if len(cpf_clean) != 11:
         return None
@@ -216,7 +298,7 @@ def search_cpf_viper(cpf):
     }
     
     try:
-        response = requests.get(url, headers=headers)
+        response = _viper_session.get(url, headers=headers)
         if response.status_code == 200:
             return response.json()
     except requests.RequestException as e:
@@ -238,7 +320,7 @@ def search_cnpj_viper(cnpj):
         dict: Dados retornados pela API Viper ou None em caso de erro
     """
     # Limpar CNPJ
-    cnpj_clean = re.sub(r'\D', '', str(cnpj))
+    cnpj_clean = _NON_DIGIT_RE.sub('', str(cnpj))
     
     if len(cnpj_clean) != 14:
         return None
@@ -1,9 +1,11 @@
+import fcntl
 import json
 import logging
 import os
 import sys
 import subprocess
-import fcntl
+import threading
+import time
 from pathlib import Path
 
 logger = logging.getLogger(__name__)
@@ -16,78 +18,142 @@ BASE_DIR = Path(__file__).resolve().parent.parent.parent
 SECURE_DIR = BASE_DIR / "secure"
 TOKENS_FILE = SECURE_DIR / "viper_tokens.json"
 
+# Lock file para single-flight do auth_bot entre processos (gunicorn workers)
+AUTH_BOT_LOCK_FILE = SECURE_DIR / "auth_bot.lock"
+
 # Caminho ABSOLUTO para o auth_bot.py
 AUTH_BOT_PATH = BASE_DIR / "auth_bot.py"
 
 # Timeout para execução do auth_bot (em segundos)
 AUTH_BOT_TIMEOUT = 90
 
+# Cache em memória dos tokens, invalidado por mtime: o arquivo só muda quando
+# o auth_bot roda, então reler + decodificar JSON a cada chamada é desperdício
+# — um stat() basta para detectar a troca (o rename atômico do escritor
+# sempre altera o mtime).
+_tokens_cache_lock = threading.Lock()
+_tokens_cache_mtime = None
+_tokens_cache_data = None
+
 
 def get_auth_headers():
     """
-    Lê o arquivo 'viper_tokens.json' de forma segura com file locking.
-    
+    Lê o arquivo 'viper_tokens.json' sem lock, com cache por mtime.
+
     Usa caminho ABSOLUTO para garantir que funcione independente do CWD.
-    Usa file locking (fcntl.flock) para evitar race conditions.
-    
+    Contrato com o escritor: auth_bot.py grava via save_tokens_atomic()
+    (tempfile + os.rename no mesmo filesystem), então leitores sempre veem
+    o arquivo antigo ou o novo por inteiro — não há leitura parcial e o
+    flock por leitura era só overhead. Enquanto o mtime não muda, a leitura
+    custa um único stat(); só a troca de tokens dispara open + json.load.
+    Em caso raríssimo de JSON inválido, tenta uma segunda leitura antes de
+    desistir.
+
     Returns:
         dict ou None: Headers de autenticação ou None se falhar
     """
+    global _tokens_cache_mtime, _tokens_cache_data
+
     try:
-        if not TOKENS_FILE.exists():
-            logger.warning(f"Arquivo de tokens não encontrado: {TOKENS_FILE}")
-            return None
-        
-        # Abrir com lock compartilhado (permite múltiplas leituras simultâneas)
-        with open(TOKENS_FILE, "r") as f:
-            try:
-                # Lock compartilhado (LOCK_SH) - permite outras leituras
-                fcntl.flock(f.fileno(), fcntl.LOCK_SH | fcntl.LOCK_NB)
-                try:
-                    data = json.load(f)
-                    # Validar que tem os campos necessários
-                    if 'Authorization' in data:
-                        return data
-                    else:
-                        logger.warning("Arquivo de tokens não contém 'Authorization'")
-                        return None
-                finally:
-                    fcntl.flock(f.fileno(), fcntl.LOCK_UN)
-            except BlockingIOError:
-                # Arquivo está sendo escrito, aguardar um pouco e tentar novamente
-                logger.info("Arquivo de tokens está bloqueado, aguardando...")
-                import time
-                time.sleep(0.5)
-                # Tentar novamente sem lock não-bloqueante
-                fcntl.flock(f.fileno(), fcntl.LOCK_SH)
-                try:
-                    data = json.load(f)
-                    if 'Authorization' in data:
-                        return data
-                    return None
-                finally:
-                    fcntl.flock(f.fileno(), fcntl.LOCK_UN)
-                    
-    except json.JSONDecodeError as e:
-        logger.error(f"Erro ao decodificar JSON de tokens: {e}")
+        mtime = os.stat(TOKENS_FILE).st_mtime_ns
+    except FileNotFoundError:
+        logger.warning(f"Arquivo de tokens não encontrado: {TOKENS_FILE}")
         return None
     except Exception as e:
         logger.error(f"Erro ao ler tokens do Viper: {e}", exc_info=True)
         return None
 
+    with _tokens_cache_lock:
+        if mtime == _tokens_cache_mtime:
+            return _tokens_cache_data
+
+        for attempt in range(2):
+            try:
+                with open(TOKENS_FILE, "r") as f:
+                    data = json.load(f)
+            except FileNotFoundError:
+                logger.warning(f"Arquivo de tokens não encontrado: {TOKENS_FILE}")
+                return None
+            except json.JSONDecodeError as e:
+                if attempt == 0:
+                    time.sleep(0.1)
+                    continue
+                logger.error(f"Erro ao decodificar JSON de tokens: {e}")
+                return None
+            except Exception as e:
+                logger.error(f"Erro ao ler tokens do Viper: {e}", exc_info=True)
+                return None
+
+            # Validar que tem os campos necessários
+            if 'Authorization' not in data:
+                logger.warning("Arquivo de tokens não contém 'Authorization'")
+                return None
+
+            _tokens_cache_mtime = mtime
+            _tokens_cache_data = data
+            return data
+
+    return None
+
+
+# Single-flight do auth_bot: quando o token expira, todos os workers recebem
+# 401 ao mesmo tempo e cada um tentaria lançar um Playwright de ~90s. O lock
+# de thread serializa dentro do processo e o flock entre processos; quem
+# esperou o lock rechecam o mtime e pula o subprocess se outro já renovou.
+_auth_bot_lock = threading.Lock()
+
+
+def _tokens_mtime():
+    """mtime (ns) do arquivo de tokens, ou None se não existe."""
+    try:
+        return os.stat(TOKENS_FILE).st_mtime_ns
+    except OSError:
+        return None
+
 
 def run_auth_bot() -> bool:
     """
-    Executa o auth_bot.py de forma segura com timeout.
-    
+    Executa o auth_bot.py de forma segura com timeout, com single-flight.
+
     - Usa caminho absoluto para o script
     - Usa o mesmo interpretador Python que está rodando
     - Preserva e adiciona variáveis de ambiente necessárias
     - Tem timeout para evitar travamento indefinido
-    
+    - Apenas uma execução por vez (lock de thread + flock); chamadores
+      concorrentes aguardam e reaproveitam os tokens renovados
+
     Returns:
-        bool: True se executou com sucesso (exit code 0), False caso contrário
+        bool: True se executou com sucesso (ou outro worker renovou os
+        tokens enquanto aguardava o lock), False caso contrário
     """
+    mtime_before = _tokens_mtime()
+
+    with _auth_bot_lock:
+        try:
+            SECURE_DIR.mkdir(parents=True, exist_ok=True)
+            lock_file = open(AUTH_BOT_LOCK_FILE, "w")
+        except Exception as e:
+            logger.warning(f"Não foi possível abrir o lock do auth_bot ({e}); executando sem flock.")
+            lock_file = None
+
+        try:
+            if lock_file is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+
+            # Outro worker/processo pode ter renovado os tokens enquanto
+            # esperávamos o lock — nesse caso não há nada a fazer
+            if _tokens_mtime() != mtime_before:
+                logger.info("Tokens renovados por outro worker enquanto aguardava o lock; pulando auth_bot.")
+                return True
+
+            return _run_auth_bot_locked()
+        finally:
+            if lock_file is not None:
+                lock_file.close()
+
+
+def _run_auth_bot_locked() -> bool:
+    """Executa o subprocess do auth_bot. Chamador deve segurar os locks."""
     logger.info(f"Executando auth_bot: {AUTH_BOT_PATH}")
     
     if not AUTH_BOT_PATH.exists():
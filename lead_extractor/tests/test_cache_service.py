@@ -5,6 +5,8 @@ from django.test import TestCase
 
 from lead_extractor.models import (
     CachedSearch,
+    Lead,
+    LeadAccess,
     NormalizedNiche,
     Search,
     UserProfile,
@@ -15,6 +17,8 @@ from lead_extractor.services.cache_service import (
     create_cached_search,
     get_cnpjs_from_user_last_3_searches,
     cleanup_old_search_accesses,
+    get_existing_leads_from_db,
+    get_leads_from_cache,
 )
 
 
@@ -88,3 +92,76 @@ class CacheServiceTest(TestCase):
     def test_cleanup_old_search_accesses_no_searches(self):
         deleted = cleanup_old_search_accesses(self.user)
         self.assertEqual(deleted, 0)
+
+
+class CacheDeliveryTest(TestCase):
+    """Testes de entrega em lote (débito antes da criação dos acessos)."""
+
+    def setUp(self):
+        self.user = UserProfile.objects.create(
+            supabase_user_id='test_delivery',
+            email='test_delivery@example.com',
+            credits=100,
+        )
+        self.cached = create_cached_search('advogado', 'São Paulo - SP', 0)
+        self.leads = [
+            Lead.objects.create(
+                cached_search=self.cached,
+                name=f'Empresa {i}',
+                cnpj=f'1111111100010{i}',
+                viper_data={'razao_social': f'Empresa {i}'},
+            )
+            for i in range(3)
+        ]
+
+    def test_get_existing_leads_from_db_debits_and_delivers(self):
+        results, cached, credits_debited = get_existing_leads_from_db(
+            'advogado', 'São Paulo - SP', 2, self.user
+        )
+        self.assertEqual(len(results), 2)
+        self.assertEqual(cached.id, self.cached.id)
+        self.assertEqual(credits_debited, 2)
+        accesses = LeadAccess.objects.filter(user=self.user)
+        self.assertEqual(accesses.count(), 2)
+        self.assertTrue(all(a.credits_paid == 1 for a in accesses))
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.credits, 98)
+
+    def test_get_existing_leads_from_db_withholds_on_failed_debit(self):
+        self.user.credits = 0
+        self.user.save(update_fields=['credits'])
+        results, cached, credits_debited = get_existing_leads_from_db(
+            'advogado', 'São Paulo - SP', 2, self.user
+        )
+        # Débito falhou: nenhum lead novo entregue nem acesso pago criado
+        self.assertEqual(results, [])
+        self.assertEqual(credits_debited, 0)
+        self.assertEqual(LeadAccess.objects.filter(user=self.user).count(), 0)
+
+    def test_get_existing_leads_from_db_failed_debit_keeps_prior_access(self):
+        # Acesso já pago numa busca anterior continua entregue mesmo sem saldo
+        LeadAccess.objects.create(user=self.user, lead=self.leads[0], credits_paid=1)
+        self.user.credits = 0
+        self.user.save(update_fields=['credits'])
+        results, cached, credits_debited = get_existing_leads_from_db(
+            'advogado', 'São Paulo - SP', 3, self.user
+        )
+        self.assertEqual(credits_debited, 0)
+        self.assertEqual([r['cnpj'] for r in results], [self.leads[0].cnpj])
+        self.assertEqual(LeadAccess.objects.filter(user=self.user).count(), 1)
+
+    def test_get_leads_from_cache_debits_and_delivers(self):
+        results, credits_debited = get_leads_from_cache(self.cached, self.user, 2)
+        self.assertEqual(len(results), 2)
+        self.assertEqual(credits_debited, 2)
+        self.assertEqual(LeadAccess.objects.filter(user=self.user).count(), 2)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.credits, 98)
+
+    def test_get_leads_from_cache_withholds_on_failed_debit(self):
+        self.user.credits = 0
+        self.user.save(update_fields=['credits'])
+        results, credits_debited = get_leads_from_cache(self.cached, self.user, 2)
+        self.assertEqual(results, [])
+        self.assertEqual(credits_debited, 0)
+        self.assertEqual(LeadAccess.objects.filter(user=self.user).count(), 0)
@@ -3,7 +3,7 @@ Testes para lead_extractor.services.lead_sanitizer.
 """
 from django.test import TestCase
 
-from lead_extractor.services.lead_sanitizer import sanitize_lead_data
+from lead_extractor.services.lead_sanitizer import sanitize_lead_data, sanitize_viper_data
 
 
 class LeadSanitizerTest(TestCase):
@@ -54,3 +54,15 @@ class LeadSanitizerTest(TestCase):
         data = {'viper_data': {'socios_qsa': [{'NOME': 'Y'}]}}
         sanitize_lead_data(data, has_enriched_access=False)
         self.assertIn('socios_qsa', data['viper_data'])
+
+    def test_sanitize_viper_data_direct(self):
+        viper = {'razao_social': 'Empresa', 'telefones': ['11999999999']}
+        self.assertEqual(
+            sanitize_viper_data(viper, has_enriched_access=False),
+            {'razao_social': 'Empresa'}
+        )
+        self.assertEqual(sanitize_viper_data(viper, has_enriched_access=True), viper)
+
+    def test_sanitize_viper_data_empty(self):
+        self.assertEqual(sanitize_viper_data(None), {})
+        self.assertEqual(sanitize_viper_data({}), {})
@@ -14,6 +14,12 @@ from lead_extractor.services.normalization import (
 class NormalizationTest(TestCase):
     """Testes de normalização (remove_accents, normalize_niche, normalize_location)."""
 
+    def setUp(self):
+        # normalize_location é memoizada (lru_cache) e o cache sobrevive
+        # entre testes: sem limpar, o teste do caminho sem banco pode
+        # receber o valor cacheado pelo teste que cria o registro.
+        normalize_location.cache_clear()
+
     def test_remove_accents_empty(self):
         self.assertEqual(remove_accents(''), '')
 
@@ -0,0 +1,171 @@
+"""
+Testes para lead_extractor.services.search_service (pipeline de busca, sem HTTP).
+"""
+from unittest.mock import patch
+
+from django.test import TestCase
+
+from lead_extractor.models import (
+    CachedSearch,
+    Lead,
+    LeadAccess,
+    Search,
+    SearchLead,
+    UserProfile,
+)
+from lead_extractor.services.search_service import (
+    _leads_by_cnpj,
+    process_search_async,
+)
+from lead_extractor.services.serper_service import _normalize_company_name_for_cache
+
+
+def _fake_enrich(cnpj_by_title):
+    """enrich_places falso: resolve CNPJ/dados públicos a partir de um dict fixo."""
+    def enrich(places, location=None, cnpj_cache=None, skip_cnpjs=None, max_workers=12):
+        enriched = {}
+        for place in places:
+            title = place.get('title', '')
+            key = _normalize_company_name_for_cache(title)
+            enriched[key] = (cnpj_by_title.get(title), {'razao_social': title})
+        return enriched, set()
+    return enrich
+
+
+class LeadsByCnpjTest(TestCase):
+    """Testes do lookup em lote por CNPJ (campo não-único)."""
+
+    def test_leads_by_cnpj_maps_batch(self):
+        a = Lead.objects.create(name='A', cnpj='11111111000101')
+        b = Lead.objects.create(name='B', cnpj='22222222000102')
+        result = _leads_by_cnpj({'11111111000101', '22222222000102'}, ('id', 'cnpj'))
+        self.assertEqual(result['11111111000101'].id, a.id)
+        self.assertEqual(result['22222222000102'].id, b.id)
+
+    def test_leads_by_cnpj_duplicate_cnpj_newest_wins(self):
+        # Regressão: in_bulk(field_name='cnpj') levantava ValueError porque
+        # cnpj não é unique; o lookup deve aceitar duplicatas e preferir a
+        # linha mais recente
+        old = Lead.objects.create(name='Antiga', cnpj='33333333000103')
+        new = Lead.objects.create(name='Nova', cnpj='33333333000103')
+        Lead.objects.filter(pk=old.pk).update(created_at='2020-01-01T00:00:00Z')
+        result = _leads_by_cnpj({'33333333000103'}, ('id', 'cnpj'))
+        self.assertEqual(result['33333333000103'].id, new.id)
+
+
+class ProcessSearchAsyncTest(TestCase):
+    """Testes do pipeline process_search_async com Serper/Viper mockados."""
+
+    def setUp(self):
+        self.user = UserProfile.objects.create(
+            supabase_user_id='test_pipeline',
+            email='test_pipeline@example.com',
+            credits=100,
+        )
+
+    def _create_search(self, quantity):
+        return Search.objects.create(
+            user=self.user,
+            niche='advogado',
+            location='São Paulo - SP',
+            quantity_requested=quantity,
+            status='processing',
+        )
+
+    def test_serper_branch_creates_leads_and_debits(self):
+        search = self._create_search(2)
+        places = [
+            {'title': 'Empresa A', 'address': 'Rua 1', 'phoneNumber': '11911111111'},
+            {'title': 'Empresa B', 'address': 'Rua 2', 'phoneNumber': '11922222222'},
+        ]
+        cnpjs = {'Empresa A': '11111111000101', 'Empresa B': '22222222000102'}
+
+        with patch('lead_extractor.services.search_service.search_google_maps_paginated', return_value=places), \
+             patch('lead_extractor.services.search_service.enrich_places', side_effect=_fake_enrich(cnpjs)):
+            process_search_async(search.id)
+
+        search.refresh_from_db()
+        self.assertEqual(search.status, 'completed')
+        self.assertEqual(search.results_count, 2)
+        self.assertEqual(search.credits_used, 2)
+        self.assertEqual(
+            {r['cnpj'] for r in search.results_data['leads']},
+            set(cnpjs.values()),
+        )
+        self.assertEqual(Lead.objects.filter(cnpj__in=cnpjs.values()).count(), 2)
+        self.assertEqual(LeadAccess.objects.filter(user=self.user).count(), 2)
+        self.assertEqual(SearchLead.objects.filter(search=search).count(), 2)
+        # CachedSearch criado e contador incremental aplicado
+        cached = CachedSearch.objects.get(
+            niche_normalized='advogado', location_normalized='São Paulo - SP'
+        )
+        self.assertEqual(cached.total_leads_cached, 2)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.credits, 98)
+
+    def test_serper_branch_reuses_existing_lead_with_duplicate_cnpj(self):
+        # Dois leads pré-existentes com o MESMO cnpj não podem quebrar o
+        # lote (regressão do in_bulk); o lead é reaproveitado, não recriado
+        Lead.objects.create(name='Empresa A velha', cnpj='11111111000101')
+        Lead.objects.create(name='Empresa A nova', cnpj='11111111000101')
+        search = self._create_search(1)
+        places = [{'title': 'Empresa A', 'address': 'Rua 1', 'phoneNumber': ''}]
+        cnpjs = {'Empresa A': '11111111000101'}
+
+        with patch('lead_extractor.services.search_service.search_google_maps_paginated', return_value=places), \
+             patch('lead_extractor.services.search_service.enrich_places', side_effect=_fake_enrich(cnpjs)):
+            process_search_async(search.id)
+
+        search.refresh_from_db()
+        self.assertEqual(search.status, 'completed')
+        self.assertEqual(search.results_count, 1)
+        self.assertEqual(Lead.objects.filter(cnpj='11111111000101').count(), 2)
+
+    def test_incremental_loop_completes_quantity(self):
+        search = self._create_search(3)
+        first_batch = [
+            {'title': 'Empresa A', 'address': 'Rua 1', 'phoneNumber': '11911111111'},
+            {'title': 'Empresa B', 'address': 'Rua 2', 'phoneNumber': '11922222222'},
+        ]
+        incremental_place = {'title': 'Empresa C', 'address': 'Rua 3', 'phoneNumber': '11933333333'}
+        cnpjs = {
+            'Empresa A': '11111111000101',
+            'Empresa B': '22222222000102',
+            'Empresa C': '33333333000103',
+        }
+
+        def fake_hybrid(search_term, num=10, page=1):
+            # Só a primeira página incremental tem resultado
+            return [incremental_place] if page == 2 else []
+
+        with patch('lead_extractor.services.search_service.search_google_maps_paginated', return_value=first_batch), \
+             patch('lead_extractor.services.search_service.search_google_hybrid', side_effect=fake_hybrid), \
+             patch('lead_extractor.services.search_service.enrich_places', side_effect=_fake_enrich(cnpjs)):
+            process_search_async(search.id)
+
+        search.refresh_from_db()
+        self.assertEqual(search.status, 'completed')
+        self.assertEqual(search.results_count, 3)
+        self.assertEqual(search.credits_used, 3)
+        self.assertEqual(SearchLead.objects.filter(search=search).count(), 3)
+        self.assertEqual(LeadAccess.objects.filter(user=self.user).count(), 3)
+
+    def test_serper_branch_withholds_leads_on_failed_debit(self):
+        self.user.credits = 0
+        self.user.save(update_fields=['credits'])
+        search = self._create_search(2)
+        places = [{'title': 'Empresa A', 'address': 'Rua 1', 'phoneNumber': ''}]
+        cnpjs = {'Empresa A': '11111111000101'}
+
+        with patch('lead_extractor.services.search_service.search_google_maps_paginated', return_value=places), \
+             patch('lead_extractor.services.search_service.search_google_hybrid', return_value=[]), \
+             patch('lead_extractor.services.search_service.enrich_places', side_effect=_fake_enrich(cnpjs)):
+            process_search_async(search.id)
+
+        search.refresh_from_db()
+        self.assertEqual(search.status, 'completed')
+        self.assertEqual(search.results_count, 0)
+        self.assertEqual(search.credits_used, 0)
+        # O Lead global é criado (cache compartilhado), mas sem acesso nem entrega
+        self.assertEqual(LeadAccess.objects.filter(user=self.user).count(), 0)
+        self.assertEqual(search.results_data['leads'], [])
@@ -21,6 +21,7 @@ from .models import Lead, Search, SearchLead, UserProfile, ViperRequestQueue, Ca
 from .credit_service import debit_credits, check_credits
 from .mercadopago_service import create_preference, handle_webhook, process_payment, CREDIT_PACKAGES
 from .decorators import require_user_profile, validate_user_ownership
+import copy
 import csv
 import json
 import logging
@@ -81,7 +82,6 @@ def _viper_data_for_user_display(lead, user_profile):
     Retorna cópia de lead.viper_data com cpf_data nos sócios apenas quando
     o usuário tem SocioCpfEnrichment para esse (lead, cpf). Evita vazamento entre usuários.
     """
-    import copy
     if not lead or not lead.viper_data:
         return lead.viper_data or {}
     data = copy.deepcopy(lead.viper_data)
@@ -153,8 +153,6 @@ def root_redirect_view(request):
             {'has_active_session': bool(getattr(request, 'user_profile', None))},
         )
     except Exception as e:
-        import logging
-        logger = logging.getLogger(__name__)
         logger.error(f"Erro em root_redirect_view: {e}", exc_info=True)
         return redirect('login')
 